@@ -0,0 +1,58 @@
+"""
+Compares benchmark results to a checked-in baseline.
+"""
+import json
+
+
+def get_value(results, path):
+    for key in path.split('.'):
+        results = results[key]
+    return results
+
+
+def find_regressions(results, baseline, metrics, max_regression):
+    """
+    Returns a message for every metric more than `max_regression` (a fraction)
+    worse than the baseline. `metrics` maps a dotted path in the results to
+    True when higher values are better.
+    """
+    if results['parameters'] != baseline['parameters']:
+        raise Exception('The baseline was recorded with different parameters: {}'.format(
+            baseline['parameters']))
+
+    regressions = []
+    for path, higher_is_better in metrics.items():
+        value = get_value(results, path)
+        expected = get_value(baseline, path)
+        if value is None or expected is None or value == expected:
+            continue
+        if expected == 0:
+            # from a zero baseline, any move in the worse direction fails
+            change = float('inf') if (value < 0) == higher_is_better else 0.0
+        elif higher_is_better:
+            change = (expected - value) / expected
+        else:
+            change = (value - expected) / expected
+        if change > max_regression:
+            regressions.append('{}: {} against a baseline of {} ({:.0%} worse)'.format(
+                path, value, expected, change))
+    return regressions
+
+
+def check(results, baseline_path, metrics, max_regression):
+    """
+    Raises SystemExit with the regressions found against the baseline file
+    """
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)
+
+    regressions = find_regressions(results, baseline, metrics, max_regression)
+    if regressions:
+        raise SystemExit('Regressed by more than {:.0%} against {}:\n{}'.format(
+            max_regression, baseline_path, '\n'.join(regressions)))
+
+
+def add_arguments(parser):
+    parser.add_argument('--baseline', help='Fail when results regress against this file')
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help='Allowed regression against the baseline, as a fraction')
@@ -0,0 +1,204 @@
+"""
+A local stand-in for the Deputy API serving synthetic oauth, INFO and QUERY
+responses with configurable size, latency and error rate.
+"""
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIELD_TYPES = ['VarChar', 'Integer', 'Float', 'Bit', 'DateTime', 'Blob']
+
+OPERATORS = {
+    'eq': lambda a, b: a == b,
+    'ne': lambda a, b: a != b,
+    'gt': lambda a, b: a > b,
+    'ge': lambda a, b: a >= b,
+    'lt': lambda a, b: a < b,
+    'le': lambda a, b: a <= b,
+    'in': lambda a, b: a in b,
+    'nn': lambda a, b: a is not None and a not in b,
+    'is': lambda a, b: a is None,
+    'ns': lambda a, b: a is not None,
+}
+
+RESOURCE_PATH = re.compile(r'^/api/v1/resource/(\w+)/(INFO|QUERY)$')
+
+EPOCH = datetime(2015, 1, 1)
+
+
+class MockDeputy():
+    """
+    Synthetic tenant: every resource has `records` rows of `fields` columns, with
+    Modified increasing by `seconds_per_record` from 2015-01-01 and Id as the row
+    number. Rows are generated once per resource and shared by all requests.
+    """
+    def __init__(self, records=1000, fields=20, latency_ms=0, error_rate=0.0,
+                 server_max=500, seconds_per_record=60, seed=0):
+        self.records = records
+        self.fields = fields
+        self.latency = latency_ms / 1000.0
+        self.error_rate = error_rate
+        self.server_max = server_max
+        self.seconds_per_record = seconds_per_record
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        self.__rows = {}
+        self.__lock = threading.Lock()
+
+    def info(self):
+        fields = {'Id': 'Integer', 'Modified': 'DateTime', 'OperationalUnit': 'Integer'}
+        for i in range(max(0, self.fields - len(fields))):
+            fields['Field{}'.format(i)] = FIELD_TYPES[i % len(FIELD_TYPES)]
+        return {'fields': fields}
+
+    def rows(self, resource_name):
+        with self.__lock:
+            if resource_name not in self.__rows:
+                self.__rows[resource_name] = self.__generate_rows()
+            return self.__rows[resource_name]
+
+    def __generate_rows(self):
+        fields = self.info()['fields']
+        rows = []
+        for i in range(1, self.records + 1):
+            modified = EPOCH + timedelta(seconds=i * self.seconds_per_record)
+            row = {}
+            for field_name, field_type in fields.items():
+                if field_type == 'Integer':
+                    row[field_name] = i
+                elif field_type == 'Float':
+                    row[field_name] = i * 1.25
+                elif field_type == 'Bit':
+                    row[field_name] = i % 2 == 0
+                elif field_type == 'DateTime':
+                    row[field_name] = modified.strftime('%Y-%m-%dT%H:%M:%S+00:00')
+                else:
+                    row[field_name] = 'value {} of {}'.format(i, field_name)
+            row['Id'] = i
+            row['OperationalUnit'] = i % 7 + 1
+            rows.append(row)
+        return rows
+
+    def query(self, resource_name, body):
+        rows = self.rows(resource_name)
+        for clause in body.get('search', {}).values():
+            compare = OPERATORS[clause['type']]
+            field, data = clause['field'], clause.get('data')
+            if field == 'Modified' and isinstance(data, str):
+                data = normalize_datetime(data)
+                rows = [row for row in rows
+                        if compare(normalize_datetime(row['Modified']), data)]
+            else:
+                rows = [row for row in rows if compare(row.get(field), data)]
+        for field in reversed(list(body.get('sort', {}).keys())):
+            rows = sorted(rows, key=lambda row, field=field: row[field],
+                          reverse=body['sort'][field] == 'desc')
+        start = body.get('start', 0)
+        count = min(body.get('max', 500), self.server_max)
+        return rows[start:start + count]
+
+    def should_fail(self):
+        with self.__lock:
+            return self.random.random() < self.error_rate
+
+    def count(self, num_bytes, failed=False):
+        with self.__lock:
+            self.requests += 1
+            self.bytes_sent += num_bytes
+            if failed:
+                self.errors += 1
+
+
+def normalize_datetime(value):
+    """
+    Returns a sortable UTC string for the ISO 8601 formats the tap sends and receives
+    """
+    value = value.replace('Z', '+00:00')
+    if '.' in value:
+        value = value[:value.index('.')] + value[value.index('+'):]
+    return datetime.fromisoformat(value).strftime('%Y-%m-%dT%H:%M:%S')
+
+
+def make_handler(deputy):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # buffer headers and body into one write, avoiding delayed-ACK stalls
+        wbufsize = -1
+
+        def log_message(self, *args): # pylint: disable=arguments-differ
+            pass
+
+        def send_json(self, status, data):
+            body = json.dumps(data).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            deputy.count(len(body), failed=status >= 500)
+
+        def read_body(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            return self.rfile.read(length) if length else b''
+
+        def handle_request(self, method):
+            body = self.read_body()
+            if deputy.latency:
+                time.sleep(deputy.latency)
+            if deputy.should_fail():
+                self.send_json(503, {'error': 'Service unavailable'})
+                return
+
+            if self.path == '/oauth/access_token' and method == 'POST':
+                self.send_json(200, {'access_token': 'benchmark_access_token',
+                                     'refresh_token': 'benchmark_refresh_token',
+                                     'expires_in': 86400})
+                return
+
+            match = RESOURCE_PATH.match(self.path)
+            if not match:
+                self.send_json(404, {'error': 'Not found'})
+            elif match.group(2) == 'INFO' and method == 'GET':
+                self.send_json(200, deputy.info())
+            elif match.group(2) == 'QUERY' and method == 'POST':
+                self.send_json(200, deputy.query(match.group(1), json.loads(body or b'{}')))
+            else:
+                self.send_json(405, {'error': 'Method not allowed'})
+
+        def do_GET(self): # pylint: disable=invalid-name
+            self.handle_request('GET')
+
+        def do_POST(self): # pylint: disable=invalid-name
+            self.handle_request('POST')
+
+    return Handler
+
+
+class MockDeputyServer():
+    """
+    Runs a MockDeputy on a background thread on a free local port. Use it as a
+    context manager; `base_url` points the tap at it.
+    """
+    def __init__(self, deputy):
+        self.deputy = deputy
+        self.__server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(deputy))
+        self.__server.daemon_threads = True
+        self.__thread = threading.Thread(target=self.__server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return 'http://127.0.0.1:{}'.format(self.__server.server_address[1])
+
+    def __enter__(self):
+        self.__thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.__server.shutdown()
+        self.__server.server_close()
@@ -0,0 +1,189 @@
+"""
+End-to-end throughput benchmark for tap-deputy against a local mock Deputy API.
+
+    python -m benchmarks.run --records 20000 --resources Timesheet Roster \
+        --sync-config '{"max_workers": 2}' --output benchmark.json
+
+With --baseline, exits non-zero when a metric is more than --max-regression
+worse than in the baseline file.
+
+Runs discovery and a sync in process and prints machine-readable results:
+records/sec, requests/sec, peak RSS and time to first record.
+"""
+import argparse
+import io
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+from singer.catalog import Catalog
+from singer import metadata
+
+from benchmarks import baseline
+from benchmarks.mock_server import MockDeputy, MockDeputyServer
+from tap_deputy.client import DeputyClient
+from tap_deputy.discover import discover, RESOURCES
+from tap_deputy.sync import sync
+
+START_DATE = '2015-01-01T00:00:00Z'
+
+# compared against the baseline, True when higher is better. Only metrics that
+# do not depend on the machine gate CI; timings and memory are reported only.
+METRICS = {
+    'discover.requests': False,
+    'sync.requests': False,
+    'sync.output_bytes': False
+}
+
+
+class MeasuringStdout(io.TextIOBase):
+    """
+    Stands in for stdout during sync: counts messages and bytes, and records when
+    the first RECORD reaches the output, without keeping the data
+    """
+    def __init__(self):
+        super().__init__()
+        self.started_at = time.monotonic()
+        self.first_record_at = None
+        self.records = 0
+        self.messages = 0
+        self.bytes = 0
+
+    def write(self, text):
+        records = text.count('{"type": "RECORD"')
+        if records and self.first_record_at is None:
+            self.first_record_at = time.monotonic()
+        self.records += records
+        self.messages += text.count('\n')
+        self.bytes += len(text)
+        return len(text)
+
+
+def get_peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def select_streams(catalog, resource_names):
+    streams = []
+    for entry in catalog.streams:
+        mdata = metadata.to_map(entry.metadata)
+        if mdata[()]['tap-deputy.resource'] not in resource_names:
+            continue
+        for breadcrumb in mdata:
+            mdata = metadata.write(mdata, breadcrumb, 'selected', True)
+        entry.metadata = metadata.to_list(mdata)
+        streams.append(entry)
+    return Catalog(streams)
+
+
+def run_benchmark(records=1000, fields=20, latency_ms=0, error_rate=0.0,
+                  resource_names=('Timesheet',), sync_config=None, seed=0):
+    deputy = MockDeputy(records=records,
+                        fields=fields,
+                        latency_ms=latency_ms,
+                        error_rate=error_rate,
+                        seed=seed)
+
+    with MockDeputyServer(deputy) as server, \
+         tempfile.TemporaryDirectory() as tmp_dir:
+        config = dict({'domain': 'benchmark.deputy.local',
+                       'base_url': server.base_url,
+                       'client_id': 'client_id',
+                       'client_secret': 'client_secret',
+                       'redirect_uri': 'http://localhost/callback',
+                       'refresh_token': 'refresh_token',
+                       'start_date': START_DATE},
+                      **(sync_config or {}))
+        config_path = os.path.join(tmp_dir, 'config.json')
+        with open(config_path, 'w') as config_file:
+            json.dump(config, config_file)
+
+        with DeputyClient(config, config_path, False) as client:
+            started_at = time.monotonic()
+            catalog = discover(client, int(config.get('discover_max_workers', 1)))
+            discover_seconds = time.monotonic() - started_at
+            discover_requests = deputy.requests
+
+            catalog = select_streams(catalog, resource_names)
+            stdout = MeasuringStdout()
+            with redirect_stdout(stdout):
+                sync(client, catalog, {}, START_DATE, config)
+            sync_seconds = time.monotonic() - stdout.started_at
+
+    sync_requests = deputy.requests - discover_requests
+    return {
+        'parameters': {
+            'records_per_resource': records,
+            'fields': fields,
+            'latency_ms': latency_ms,
+            'error_rate': error_rate,
+            'resources': list(resource_names),
+            'sync_config': sync_config or {}
+        },
+        'discover': {
+            'seconds': round(discover_seconds, 4),
+            'requests': discover_requests,
+            'requests_per_second': round(discover_requests / discover_seconds, 2)
+        },
+        'sync': {
+            'seconds': round(sync_seconds, 4),
+            'records': stdout.records,
+            'records_per_second': round(stdout.records / sync_seconds, 2),
+            'requests': sync_requests,
+            'requests_per_second': round(sync_requests / sync_seconds, 2),
+            'server_errors': deputy.errors,
+            'output_bytes': stdout.bytes,
+            'response_bytes': deputy.bytes_sent,
+            'time_to_first_record_seconds':
+                round(stdout.first_record_at - stdout.started_at, 4)
+                if stdout.first_record_at else None
+        },
+        'peak_rss_mb': round(get_peak_rss_mb(), 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--records', type=int, default=10000,
+                        help='Rows served per resource')
+    parser.add_argument('--fields', type=int, default=20,
+                        help='Columns per resource')
+    parser.add_argument('--latency-ms', type=float, default=0,
+                        help='Added latency per request')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Fraction of requests answered with a 503')
+    parser.add_argument('--resources', nargs='+', default=['Timesheet'], metavar='RESOURCE',
+                        choices=sorted(RESOURCES.keys()),
+                        help='Resources to sync')
+    parser.add_argument('--sync-config', type=json.loads, default={},
+                        help='Extra tap config as json, e.g. \'{"max_workers": 4}\'')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Also write the results to this file')
+    baseline.add_arguments(parser)
+    args = parser.parse_args()
+
+    results = run_benchmark(records=args.records,
+                            fields=args.fields,
+                            latency_ms=args.latency_ms,
+                            error_rate=args.error_rate,
+                            resource_names=args.resources,
+                            sync_config=args.sync_config,
+                            seed=args.seed)
+
+    json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+    if args.baseline:
+        baseline.check(results, args.baseline, METRICS, args.max_regression)
+
+
+if __name__ == '__main__':
+    main()
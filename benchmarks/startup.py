@@ -0,0 +1,94 @@
+"""
+Startup benchmark for short tap-deputy runs against a local mock Deputy API.
+
+    python -m benchmarks.startup --runs 10 --output startup.json \
+        --baseline benchmarks/baselines/startup.json
+
+Times fresh interpreter runs of the import alone, `--check` and `--discover`
+and prints the median and fastest wall time of each, with the requests sent.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import baseline
+from benchmarks.mock_server import MockDeputy, MockDeputyServer
+
+MODES = {
+    'import': [sys.executable, '-c', 'import tap_deputy'],
+    'check': [sys.executable, '-c', 'from tap_deputy import main; main()', '--check'],
+    'discover': [sys.executable, '-c', 'from tap_deputy import main; main()', '--discover']
+}
+
+# compared against the baseline, True when higher is better. Only metrics that
+# do not depend on the machine gate CI; timings are reported only.
+METRICS = {
+    'import.requests_per_run': False,
+    'check.requests_per_run': False,
+    'discover.requests_per_run': False
+}
+
+
+def time_run(command):
+    started_at = time.monotonic()
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.monotonic() - started_at
+
+
+def run_benchmark(runs=10):
+    deputy = MockDeputy(records=0)
+    results = {'parameters': {'runs': runs}}
+
+    with MockDeputyServer(deputy) as server, \
+         tempfile.TemporaryDirectory() as tmp_dir:
+        config_path = os.path.join(tmp_dir, 'config.json')
+        with open(config_path, 'w') as config_file:
+            json.dump({'domain': 'benchmark.deputy.local',
+                       'base_url': server.base_url,
+                       'client_id': 'client_id',
+                       'client_secret': 'client_secret',
+                       'redirect_uri': 'http://localhost/callback',
+                       'refresh_token': 'refresh_token',
+                       'start_date': '2015-01-01T00:00:00Z'},
+                      config_file)
+
+        for mode, command in MODES.items():
+            if mode != 'import':
+                command = command + ['-c', config_path]
+            requests_before = deputy.requests
+            seconds = [time_run(command) for _ in range(runs)]
+            results[mode] = {
+                'median_seconds': round(statistics.median(seconds), 4),
+                'min_seconds': round(min(seconds), 4),
+                'requests_per_run': (deputy.requests - requests_before) / runs
+            }
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--runs', type=int, default=10,
+                        help='Runs per mode')
+    parser.add_argument('--output', help='Also write the results to this file')
+    baseline.add_arguments(parser)
+    args = parser.parse_args()
+
+    results = run_benchmark(args.runs)
+
+    json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+    if args.baseline:
+        baseline.check(results, args.baseline, METRICS, args.max_regression)
+
+
+if __name__ == '__main__':
+    main()
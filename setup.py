@@ -16,6 +16,12 @@ setup(name='tap-deputy',
           'singer-python==5.13.2'
       ],
       extras_require= {
+          'streaming': [
+              'ijson>=3.1',
+          ],
+          'async': [
+              'aiohttp',
+          ],
           'dev': [
               'pylint',
               'nose',
@@ -25,6 +31,7 @@ setup(name='tap-deputy',
       entry_points='''
           [console_scripts]
           tap-deputy=tap_deputy:main
+          tap-deputy-multi=tap_deputy.runner:main
       ''',
       packages=['tap_deputy']
 )
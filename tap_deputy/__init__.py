@@ -2,14 +2,17 @@
 
 import sys
 import json
-import argparse
 
 import singer
-from singer.utils import parse_args
 
-from tap_deputy.client import DeputyClient
-from tap_deputy.discover import discover
-from tap_deputy.sync import sync
+from tap_deputy.client import (AUTH_ERROR_MESSAGE,
+                               AUTH_PROBE_PATH,
+                               AUTH_PROBE_RESOURCE,
+                               DeputyClient)
+
+# Modules only some modes need (sync, discover and the aiohttp backend) are
+# imported inside the functions that use them, so short discover and check runs
+# do not pay for them at startup.
 
 LOGGER = singer.get_logger()
 
@@ -22,32 +25,96 @@ REQUIRED_CONFIG_KEYS = [
     'refresh_token'
 ]
 
-def do_discover(client):
+def parse_args(required_config_keys):
+    """
+    Parses the standard Singer tap arguments with singer.utils.parse_args, plus
+    `--check`, which only validates the credentials
+    """
+    check = '--check' in sys.argv[1:]
+    if check:
+        sys.argv = [arg for arg in sys.argv if arg != '--check']
+    args = singer.utils.parse_args(required_config_keys)
+    args.check = check
+    return args
+
+def test_authentication(client):
+    """
+    Fetches a resource INFO object to check the credentials, returning it so
+    discovery does not request it again
+    """
     LOGGER.info('Testing authentication')
     try:
-        # test by making the client fetch a resource info object
-        client.get(
-            '/api/v1/resource/Contact/INFO',
-            endpoint='resource_info')
+        return client.get(AUTH_PROBE_PATH, endpoint='resource_info')
     except Exception as err:
-        raise Exception('Error testing Deputy authentication') from err
+        raise Exception(AUTH_ERROR_MESSAGE) from err
+
+def do_check(client):
+    test_authentication(client)
+    LOGGER.info('Authentication succeeded')
 
-    LOGGER.info('Starting discover')
-    catalog = discover(client)
+def write_catalog(catalog):
     json.dump(catalog.to_dict(), sys.stdout, indent=2)
     LOGGER.info('Finished discover')
 
+def use_asyncio_discovery(parsed_args):
+    # refreshing a catalog always runs on the threaded client
+    return parsed_args.discover and not parsed_args.check and not parsed_args.catalog and \
+        parsed_args.config.get('discover_backend') == 'asyncio'
+
+def do_discover(client, config, catalog=None):
+    from tap_deputy import utils
+    from tap_deputy.discover import discover, refresh_catalog
+    from tap_deputy.schema_cache import SchemaCache
+
+    max_workers = utils.get_int(config, 'discover_max_workers', 1)
+    cache = SchemaCache.from_config(config)
+
+    known_infos = {AUTH_PROBE_RESOURCE: test_authentication(client)}
+    if catalog:
+        LOGGER.info('Starting discover, refreshing the provided catalog')
+        catalog, _ = refresh_catalog(client, catalog, max_workers, cache, known_infos)
+    else:
+        LOGGER.info('Starting discover')
+        catalog = discover(client, max_workers, cache, known_infos)
+
+    write_catalog(catalog)
+
+def do_discover_asyncio(config, config_path=None, dev_mode=False):
+    """
+    Runs discovery on an event loop with its own aiohttp client, so no threaded
+    client is built
+    """
+    from tap_deputy import utils
+    from tap_deputy.async_client import discover_with_asyncio
+    from tap_deputy.schema_cache import SchemaCache
+
+    LOGGER.info('Starting discover with the asyncio backend')
+    write_catalog(discover_with_asyncio(config,
+                                        config_path,
+                                        dev_mode,
+                                        utils.get_int(config, 'discover_max_workers', 1),
+                                        SchemaCache.from_config(config)))
+
 @singer.utils.handle_top_exception(LOGGER)
 def main():
     parsed_args = parse_args(REQUIRED_CONFIG_KEYS)
     if parsed_args.dev:
         LOGGER.warning("Executing Tap in Dev mode",)
 
+    if use_asyncio_discovery(parsed_args):
+        do_discover_asyncio(parsed_args.config, parsed_args.config_path, parsed_args.dev)
+        return
+
     with DeputyClient(parsed_args.config, parsed_args.config_path, parsed_args.dev) as client:
-        if parsed_args.discover:
-            do_discover(client)
+        if parsed_args.check:
+            do_check(client)
+        elif parsed_args.discover:
+            do_discover(client, parsed_args.config, parsed_args.catalog)
         else:
+            from tap_deputy.sync import sync
+
             sync(client,
                  parsed_args.catalog,
                  parsed_args.state,
-                 parsed_args.config['start_date'])
+                 parsed_args.config['start_date'],
+                 parsed_args.config)
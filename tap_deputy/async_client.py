@@ -0,0 +1,217 @@
+import asyncio
+from datetime import timedelta
+
+import backoff
+from singer import metrics, get_logger
+from singer.utils import now, strftime
+
+from tap_deputy import rate_limit, utils
+from tap_deputy.discover import discover_async
+from tap_deputy.client import (AUTH_ERROR_MESSAGE,
+                               AUTH_PROBE_PATH,
+                               AUTH_PROBE_RESOURCE,
+                               DEFAULT_ACCEPT_ENCODING,
+                               DEFAULT_CONNECT_TIMEOUT,
+                               DEFAULT_REQUEST_TIMEOUT,
+                               Server401TokenExpiredError,
+                               Server429Error,
+                               Server5xxError,
+                               get_stored_expiry)
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+LOGGER = get_logger()
+
+DEFAULT_CONNECTION_LIMIT = 100
+
+RETRY_ERRORS = (Server401TokenExpiredError,
+                Server429Error,
+                Server5xxError,
+                asyncio.TimeoutError)
+if aiohttp is not None:
+    RETRY_ERRORS += (aiohttp.ClientConnectionError,)
+
+
+class AsyncDeputyClient():
+    """
+    asyncio counterpart of DeputyClient built on aiohttp, with the same get/post/refresh
+    contract, token refresh semantics, rate limiter and backoff policy. Use it as an
+    async context manager.
+    """
+    def __init__(self, config, config_path, dev_mode):
+        if aiohttp is None:
+            raise Exception('asyncio discovery requires aiohttp, '
+                            'install it with `pip install tap-deputy[async]`')
+
+        self.__config_path = config_path
+        self.__user_agent = config.get('user_agent')
+        self.__domain = config.get('domain')
+        self.__base_url = config.get('base_url') or 'https://{}'.format(self.__domain)
+        self.__client_id = config.get('client_id')
+        self.__client_secret = config.get('client_secret')
+        self.__redirect_uri = config.get('redirect_uri')
+        self.__refresh_token = config.get('refresh_token')
+        self.__access_token = config.get('access_token')
+        self.__dev_mode = dev_mode
+        self.__connection_limit = utils.get_int(config, 'pool_maxsize', DEFAULT_CONNECTION_LIMIT)
+        self.__accept_encoding = config.get('accept_encoding', DEFAULT_ACCEPT_ENCODING)
+        self.__timeout = aiohttp.ClientTimeout(
+            sock_connect=utils.get_float(config, 'connect_timeout', DEFAULT_CONNECT_TIMEOUT),
+            sock_read=utils.get_float(config, 'request_timeout', DEFAULT_REQUEST_TIMEOUT))
+        self.__rate_limiter = rate_limit.get_rate_limiter(
+            self.__domain,
+            utils.get_float(config, 'requests_per_second', None),
+            utils.get_int(config, 'rate_limit_burst', None))
+        self.__session = None
+        self.__refresh_lock = None
+        self.__expires_at = get_stored_expiry(config)
+
+    @property
+    def refresh_token(self):
+        return self.__refresh_token
+
+    @property
+    def access_token(self):
+        return self.__access_token
+
+    @property
+    def expires_at(self):
+        return self.__expires_at
+
+    @expires_at.setter
+    def expires_at(self, value):
+        self.__expires_at = value
+
+    async def __aenter__(self):
+        self.__session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.__connection_limit),
+            timeout=self.__timeout,
+            headers={'Accept-Encoding': self.__accept_encoding})
+        self.__refresh_lock = asyncio.Lock()
+        return self
+
+    async def __aexit__(self, _type, value, traceback):
+        await self.__session.close()
+
+    def __token_expired(self):
+        return self.__access_token is None or self.__expires_at <= now()
+
+    async def refresh(self):
+        """
+        Checks token expiry and refreshes token if access token is expired
+        """
+        if self.__dev_mode:
+            if not self.access_token:
+                raise Exception('Access token is missing')
+
+            return
+
+        data = await self.post(
+            '/oauth/access_token',
+            auth_call=True,
+            data={
+                'client_id': self.__client_id,
+                'client_secret': self.__client_secret,
+                'redirect_uri': self.__redirect_uri,
+                'refresh_token': self.__refresh_token,
+                'grant_type': 'refresh_token',
+                'scope': 'longlife_refresh_token'
+            })
+
+        self.__refresh_token = data['refresh_token']
+        self.__access_token = data['access_token']
+        # pad by 10 seconds for clock drift
+        self.__expires_at = now() + timedelta(seconds=data['expires_in'] - 10)
+
+        utils.write_config(self.__config_path,
+                           {"refresh_token": self.__refresh_token,
+                            "access_token": self.__access_token,
+                            "expires_at": strftime(self.__expires_at)})
+
+    @backoff.on_exception(backoff.expo,
+                          RETRY_ERRORS,
+                          max_tries=5,
+                          factor=2)
+    async def request(self, method, path=None, url=None, auth_call=False, **kwargs):
+        if auth_call is False and self.__token_expired():
+            async with self.__refresh_lock:
+                # another task may have refreshed while this one waited
+                if self.__token_expired():
+                    await self.refresh()
+
+        if url is None and path:
+            url = '{}{}'.format(self.__base_url, path)
+
+        endpoint = kwargs.pop('endpoint', None)
+
+        if 'headers' not in kwargs:
+            kwargs['headers'] = {}
+
+        access_token = self.__access_token
+        kwargs['headers']['Authorization'] = 'OAuth {}'.format(access_token)
+
+        if self.__user_agent:
+            kwargs['headers']['User-Agent'] = self.__user_agent
+
+        wait = self.__rate_limiter.try_acquire()
+        while wait > 0:
+            await asyncio.sleep(wait)
+            wait = self.__rate_limiter.try_acquire()
+
+        with metrics.http_request_timer(endpoint) as timer:
+            async with self.__session.request(method, url, **kwargs) as response:
+                timer.tags[metrics.Tag.http_status_code] = response.status
+
+                if response.status == 401:
+                    if auth_call:
+                        # retrying with the same rejected refresh token cannot succeed
+                        raise Exception('Deputy rejected the refresh token: {}'.format(
+                            await response.text()))
+                    # expire the token so the retry refreshes it, unless another
+                    # task already replaced it
+                    if self.__access_token == access_token:
+                        self.__expires_at = now() - timedelta(seconds=10)
+                    raise Server401TokenExpiredError()
+
+                if response.status == 429:
+                    retry_after = rate_limit.parse_retry_after(
+                        response.headers.get('Retry-After'))
+                    if retry_after:
+                        LOGGER.warning(
+                            'Rate limited by Deputy, pausing requests for {} seconds'.format(
+                                retry_after))
+                        self.__rate_limiter.pause(retry_after)
+                    raise Server429Error()
+
+                if response.status >= 500:
+                    raise Server5xxError()
+
+                response.raise_for_status()
+
+                return await response.json(content_type=None)
+
+    async def get(self, path, **kwargs):
+        return await self.request('GET', path=path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.request('POST', path=path, **kwargs)
+
+
+def discover_with_asyncio(config, config_path, dev_mode, max_workers, cache=None):
+    """
+    Tests authentication, then runs discovery on a new event loop with up to
+    `max_workers` INFO requests in flight
+    """
+    async def run():
+        async with AsyncDeputyClient(config, config_path, dev_mode) as client:
+            try:
+                info = await client.get(AUTH_PROBE_PATH, endpoint='resource_info')
+            except Exception as err:
+                raise Exception(AUTH_ERROR_MESSAGE) from err
+            # discovery needs the probe's INFO too
+            return await discover_async(client, max_workers, cache, {AUTH_PROBE_RESOURCE: info})
+
+    return asyncio.run(run())
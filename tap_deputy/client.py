@@ -1,16 +1,33 @@
+import threading
+import time
 from datetime import timedelta
 import backoff
 import requests
 
 from singer import metrics, get_logger
-from singer.utils import now, strftime
-from requests.exceptions import ConnectionError
-from tap_deputy import utils
+from singer.utils import now, strftime, strptime_to_utc
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, Timeout
+from tap_deputy import instrumentation, rate_limit, utils
 
+try:
+    import ijson
+except ImportError:
+    ijson = None
 
 
 LOGGER = get_logger()
 
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_REQUEST_TIMEOUT = 300
+DEFAULT_ACCEPT_ENCODING = 'gzip, deflate'
+
+# checking the credentials fetches this resource's INFO, which discovery reuses
+AUTH_PROBE_RESOURCE = 'Contact'
+AUTH_PROBE_PATH = '/api/v1/resource/{}/INFO'.format(AUTH_PROBE_RESOURCE)
+AUTH_ERROR_MESSAGE = 'Error testing Deputy authentication'
+
 
 class Server401TokenExpiredError(Exception):
     pass
@@ -18,21 +35,87 @@ class Server401TokenExpiredError(Exception):
 class Server5xxError(Exception):
     pass
 
+class Server429Error(Exception):
+    pass
+
+
+def get_pool_size(config):
+    """
+    Sizes the connection pool for the most requests the tap can have in flight:
+    streams x backfill windows or shards x (current + prefetched pages), or
+    discovery workers
+    """
+    in_flight = utils.get_int(config, 'max_workers', 1) * \
+                max(utils.get_int(config, 'backfill_max_workers', 1),
+                    utils.get_int(config, 'shard_max_workers', 1)) * \
+                (1 + utils.get_int(config, 'prefetch_pages', 0))
+    return max(DEFAULT_POOL_SIZE,
+               in_flight,
+               utils.get_int(config, 'discover_max_workers', 1))
+
+
+def get_stored_expiry(config):
+    """
+    Returns the expiry of the access token stored in the config, so a token that is
+    still valid is reused. Without one, the token is refreshed on the first request.
+    """
+    if config.get('access_token') and config.get('expires_at'):
+        try:
+            return strptime_to_utc(config['expires_at'])
+        except (TypeError, ValueError):
+            LOGGER.warning('Ignoring unparseable expires_at: {}'.format(config['expires_at']))
+    return now() - timedelta(seconds=10)
+
+
+def count_retry(details):
+    endpoint = details['kwargs'].get('endpoint')
+    if endpoint:
+        instrumentation.get_stats(endpoint).add('retry_count')
+
+
+def iter_json_items(response):
+    """
+    Yields the items of a json array response body. With ijson installed the body is
+    decoded incrementally as it is read from the socket, otherwise it is buffered
+    and parsed whole.
+    """
+    with response:
+        if ijson is None:
+            yield from response.json()
+            return
+
+        response.raw.decode_content = True
+        yield from ijson.items(response.raw, 'item', use_float=True)
+
 
 class DeputyClient():
     def __init__(self, config, config_path, dev_mode):
         self.__config_path = config_path
         self.__user_agent = config.get('user_agent')
         self.__domain = config.get('domain')
+        self.__base_url = config.get('base_url') or 'https://{}'.format(self.__domain)
         self.__client_id = config.get('client_id')
         self.__client_secret = config.get('client_secret')
         self.__redirect_uri = config.get('redirect_uri')
         self.__refresh_token = config.get('refresh_token')
         self.__access_token = config.get('access_token')
         self.__session = requests.Session()
+        pool_size = utils.get_int(config, 'pool_maxsize', get_pool_size(config))
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.__session.mount('https://', adapter)
+        self.__session.mount('http://', adapter)
+        self.__session.headers['Accept-Encoding'] = config.get('accept_encoding',
+                                                               DEFAULT_ACCEPT_ENCODING)
+        self.__timeout = (utils.get_float(config, 'connect_timeout', DEFAULT_CONNECT_TIMEOUT),
+                          utils.get_float(config, 'request_timeout', DEFAULT_REQUEST_TIMEOUT))
         self.__dev_mode = dev_mode
-        # Access token will be refreshed at the beginning of every extraction
-        self.__expires_at = now() - timedelta(seconds=10)
+        self.__rate_limiter = rate_limit.get_rate_limiter(
+            self.__domain,
+            utils.get_float(config, 'requests_per_second', None),
+            utils.get_int(config, 'rate_limit_burst', None))
+        # Serializes token refreshes when the client is shared by several threads
+        self.__refresh_lock = threading.Lock()
+        self.__expires_at = get_stored_expiry(config)
 
     @property
     def refresh_token(self):
@@ -56,6 +139,9 @@ class DeputyClient():
     def __exit__(self, _type, value, traceback):
         self.__session.close()
 
+    def __token_expired(self):
+        return self.__access_token is None or self.__expires_at <= now()
+
     def refresh(self):
         """
         Checks token expiry and refreshes token if access token is expired
@@ -89,17 +175,23 @@ class DeputyClient():
                             "expires_at": strftime(self.__expires_at)})
 
     @backoff.on_exception(backoff.expo,
-                          (Server401TokenExpiredError, Server5xxError, ConnectionError),
+                          (Server401TokenExpiredError,
+                           Server429Error,
+                           Server5xxError,
+                           ConnectionError,
+                           Timeout),
                           max_tries=5,
-                          factor=2)
-    def request(self, method, path=None, url=None, auth_call=False, **kwargs):
-        if auth_call is False and \
-            (self.__access_token is None or
-             self.__expires_at <= now()):
-            self.refresh()
+                          factor=2,
+                          on_backoff=count_retry)
+    def request(self, method, path=None, url=None, auth_call=False, stream=False, **kwargs):
+        if auth_call is False and self.__token_expired():
+            with self.__refresh_lock:
+                # another thread may have refreshed while this one waited
+                if self.__token_expired():
+                    self.refresh()
 
         if url is None and path:
-            url = 'https://{}{}'.format(self.__domain, path)
+            url = '{}{}'.format(self.__base_url, path)
 
         if 'endpoint' in kwargs:
             endpoint = kwargs['endpoint']
@@ -107,29 +199,76 @@ class DeputyClient():
         else:
             endpoint = None
 
+        # called with every response, including failed attempts that are retried
+        response_hook = kwargs.pop('response_hook', None)
+
         if 'headers' not in kwargs:
             kwargs['headers'] = {}
 
-        kwargs['headers']['Authorization'] = 'OAuth {}'.format(
-            self.__access_token)
+        kwargs.setdefault('timeout', self.__timeout)
+
+        access_token = self.__access_token
+        kwargs['headers']['Authorization'] = 'OAuth {}'.format(access_token)
 
         if self.__user_agent:
             kwargs['headers']['User-Agent'] = self.__user_agent
 
+        stats = instrumentation.get_stats(endpoint) if endpoint else None
+
+        started_at = time.perf_counter()
+        self.__rate_limiter.acquire()
+        sent_at = time.perf_counter()
+
         with metrics.http_request_timer(endpoint) as timer:
-            response = self.__session.request(method, url, **kwargs)
+            response = self.__session.request(method, url, stream=stream, **kwargs)
             timer.tags[metrics.Tag.http_status_code] = response.status_code
 
+        if stats:
+            stats.add_seconds('rate_limit_wait', sent_at - started_at)
+            stats.add_seconds('request', time.perf_counter() - sent_at)
+            stats.add('http_request_count')
+            if stream:
+                stats.add('bytes_received', int(response.headers.get('Content-Length') or 0))
+            else:
+                stats.add('bytes_received', len(response.content))
+
+        if response_hook:
+            response_hook(response)
+
+        if stream and response.status_code >= 400:
+            response.close()
+
         if response.status_code == 401:
-            # pad by 10 seconds for clock drift
-            self.__expires_at = self.__expires_at or now() - timedelta(seconds=10)
+            if auth_call:
+                # the refresh lock is held by the caller, and retrying with the
+                # same rejected refresh token cannot succeed
+                raise Exception('Deputy rejected the refresh token: {}'.format(response.text))
+            with self.__refresh_lock:
+                # expire the token so the retry refreshes it, unless another
+                # thread already replaced it
+                if self.__access_token == access_token:
+                    self.__expires_at = now() - timedelta(seconds=10)
             raise Server401TokenExpiredError()
 
+        if response.status_code == 429:
+            retry_after = rate_limit.parse_retry_after(response.headers.get('Retry-After'))
+            if retry_after:
+                LOGGER.warning('Rate limited by Deputy, pausing requests for {} seconds'.format(
+                    retry_after))
+                self.__rate_limiter.pause(retry_after)
+            raise Server429Error()
+
         if response.status_code >= 500:
             raise Server5xxError()
 
         response.raise_for_status()
 
+        if stream:
+            return iter_json_items(response)
+
+        if stats:
+            with stats.timer('decode'):
+                return response.json()
         return response.json()
 
     def get(self, path, **kwargs):
@@ -137,3 +276,10 @@ class DeputyClient():
 
     def post(self, path, **kwargs):
         return self.request('POST', path=path, **kwargs)
+
+    def stream_post(self, path, **kwargs):
+        """
+        Sends the request immediately and returns an iterator over the records of the
+        json array response, decoded as they arrive
+        """
+        return self.request('POST', path=path, stream=True, **kwargs)
@@ -1,5 +1,15 @@
+import asyncio
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from singer import get_logger, metadata as singer_metadata
 from singer.catalog import Catalog, CatalogEntry, Schema
 
+LOGGER = get_logger()
+
+FINGERPRINT_KEY = 'tap-deputy.schema-fingerprint'
+
 RESOURCES = {
     'Address': 'addresses',
     'Category': 'categories',
@@ -70,17 +80,32 @@ TYPE_MAP = {
     'Time': 'string'
 }
 
-def get_schema(client, resource_name):
-    data = client.get(
-        '/api/v1/resource/{}/INFO'.format(resource_name),
-        endpoint='resource_info')
+def get_resource_info(client, resource_name, cache=None):
+    data = cache.get(resource_name) if cache else None
+    if data is None:
+        data = client.get(
+            '/api/v1/resource/{}/INFO'.format(resource_name),
+            endpoint='resource_info')
+        if cache:
+            cache.put(resource_name, data)
+    return data
+
+def get_schema(client, resource_name, cache=None):
+    data = get_resource_info(client, resource_name, cache)
+    return build_schema(resource_name, data)
+
+def get_fingerprint(data):
+    fields = json.dumps(data['fields'], sort_keys=True)
+    return hashlib.sha1(fields.encode('utf-8')).hexdigest()
 
+def build_schema(resource_name, data):
     properties = {}
     metadata = [
         {
             'breadcrumb': [],
             'metadata': {
-                'tap-deputy.resource': resource_name
+                'tap-deputy.resource': resource_name,
+                FINGERPRINT_KEY: get_fingerprint(data)
             }
         }
     ]
@@ -117,15 +142,54 @@ def get_schema(client, resource_name):
 
     return schema, metadata
 
-def discover(client):
+def fetch_resource_infos(client, resource_names, max_workers, cache=None, known_infos=None):
+    """
+    Fetches the INFO response of every resource, up to `max_workers` at a time,
+    except those already in `known_infos`.
+    A failed resource does not cancel the others; failures are retried once
+    serially after the concurrent pass, so completed calls are never repeated.
+    """
+    known_infos = known_infos or {}
+    if cache:
+        for resource_name, data in known_infos.items():
+            cache.put(resource_name, data)
+
+    def fetch(resource_name):
+        if resource_name in known_infos:
+            return known_infos[resource_name], None
+        try:
+            return get_resource_info(client, resource_name, cache), None
+        except Exception as err: # pylint: disable=broad-except
+            return None, err
+
+    if max_workers > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = dict(zip(resource_names, executor.map(fetch, resource_names)))
+    else:
+        results = {resource_name: fetch(resource_name) for resource_name in resource_names}
+
+    infos = {}
+    for resource_name in resource_names:
+        result, err = results[resource_name]
+        if err is not None:
+            LOGGER.warning('Retrying schema discovery for {}: {}'.format(resource_name, err))
+            result = get_resource_info(client, resource_name, cache)
+        infos[resource_name] = result
+
+    return infos
+
+def fetch_schemas(client, resource_names, max_workers, cache=None, known_infos=None):
+    infos = fetch_resource_infos(client, resource_names, max_workers, cache, known_infos)
+    return {resource_name: build_schema(resource_name, infos[resource_name])
+            for resource_name in resource_names}
+
+def build_catalog(schemas):
     catalog = Catalog([])
 
-    for resource_name in RESOURCES.keys():
-        schema_dict, metadata = get_schema(client, resource_name)
+    for resource_name, stream_name in RESOURCES.items():
+        schema_dict, metadata = schemas[resource_name]
         schema = Schema.from_dict(schema_dict)
 
-        stream_name = RESOURCES[resource_name]
-
         catalog.streams.append(CatalogEntry(
             stream=stream_name,
             tap_stream_id=stream_name,
@@ -135,3 +199,135 @@ def discover(client):
         ))
 
     return catalog
+
+def discover(client, max_workers=1, cache=None, known_infos=None):
+    try:
+        schemas = fetch_schemas(client, list(RESOURCES.keys()), max_workers, cache,
+                                known_infos)
+    finally:
+        # keep whatever was fetched, even when discovery fails partway
+        if cache:
+            cache.save()
+
+    return build_catalog(schemas)
+
+def merge_metadata(old_metadata, new_metadata):
+    """
+    Copies user-set metadata, such as `selected`, from the old entry onto the
+    breadcrumbs that still exist. Keys the tap generates come from the new entry.
+    """
+    old_map = singer_metadata.to_map(old_metadata)
+    merged = []
+    for entry in new_metadata:
+        breadcrumb = tuple(entry['breadcrumb'])
+        values = dict(old_map.get(breadcrumb, {}))
+        values.update(entry['metadata'])
+        merged.append({'breadcrumb': entry['breadcrumb'], 'metadata': values})
+    return merged
+
+def refresh_catalog(client, catalog, max_workers=1, cache=None, known_infos=None):
+    """
+    Refreshes an existing catalog in place of a full rediscovery. INFO is only
+    requested for resources without a fresh cache entry. Entries whose schema
+    fingerprint is unchanged are kept as they are; changed entries are rebuilt with
+    their selections and other metadata preserved. Returns the catalog and the
+    fields added and removed per stream.
+    """
+    try:
+        infos = fetch_resource_infos(client, list(RESOURCES.keys()), max_workers, cache,
+                                     known_infos)
+    finally:
+        if cache:
+            cache.save()
+
+    existing = {entry.tap_stream_id: entry for entry in catalog.streams}
+    refreshed = Catalog([])
+    changes = {}
+
+    for resource_name, stream_name in RESOURCES.items():
+        old_entry = existing.pop(stream_name, None)
+        data = infos[resource_name]
+        old_root = singer_metadata.to_map(old_entry.metadata).get((), {}) if old_entry else {}
+
+        if old_entry and old_root.get(FINGERPRINT_KEY) == get_fingerprint(data):
+            refreshed.streams.append(old_entry)
+            continue
+
+        schema_dict, metadata = build_schema(resource_name, data)
+        new_fields = set(schema_dict['properties'].keys())
+        if old_entry:
+            metadata = merge_metadata(old_entry.metadata, metadata)
+            old_fields = set((old_entry.schema.properties or {}).keys())
+        else:
+            old_fields = set()
+
+        added = sorted(new_fields - old_fields)
+        removed = sorted(old_fields - new_fields)
+        if added or removed:
+            changes[stream_name] = {'added': added, 'removed': removed}
+            LOGGER.info('{} - Schema changed, added fields: {}, removed fields: {}'.format(
+                stream_name, added, removed))
+
+        refreshed.streams.append(CatalogEntry(
+            stream=stream_name,
+            tap_stream_id=stream_name,
+            key_properties=['Id'],
+            schema=Schema.from_dict(schema_dict),
+            metadata=metadata
+        ))
+
+    # streams the tap no longer knows about are left untouched
+    refreshed.streams.extend(existing.values())
+
+    return refreshed, changes
+
+async def get_resource_info_async(client, resource_name, cache=None):
+    data = cache.get(resource_name) if cache else None
+    if data is None:
+        data = await client.get(
+            '/api/v1/resource/{}/INFO'.format(resource_name),
+            endpoint='resource_info')
+        if cache:
+            cache.put(resource_name, data)
+    return data
+
+async def fetch_schemas_async(client, resource_names, max_workers, cache=None,
+                              known_infos=None):
+    """
+    Same contract as fetch_schemas, with up to `max_workers` INFO requests in
+    flight on the running event loop
+    """
+    semaphore = asyncio.Semaphore(max_workers)
+    known_infos = known_infos or {}
+    if cache:
+        for resource_name, data in known_infos.items():
+            cache.put(resource_name, data)
+
+    async def fetch(resource_name):
+        if resource_name in known_infos:
+            return build_schema(resource_name, known_infos[resource_name])
+        async with semaphore:
+            data = await get_resource_info_async(client, resource_name, cache)
+        return build_schema(resource_name, data)
+
+    results = await asyncio.gather(*[fetch(resource_name) for resource_name in resource_names],
+                                   return_exceptions=True)
+
+    schemas = {}
+    for resource_name, result in zip(resource_names, results):
+        if isinstance(result, Exception):
+            LOGGER.warning('Retrying schema discovery for {}: {}'.format(resource_name, result))
+            result = await fetch(resource_name)
+        schemas[resource_name] = result
+
+    return schemas
+
+async def discover_async(client, max_workers=1, cache=None, known_infos=None):
+    try:
+        schemas = await fetch_schemas_async(client, list(RESOURCES.keys()), max_workers, cache,
+                                            known_infos)
+    finally:
+        if cache:
+            cache.save()
+
+    return build_catalog(schemas)
@@ -0,0 +1,158 @@
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+from singer import get_logger, metrics
+
+LOGGER = get_logger()
+
+# Seconds are accumulated per phase:
+#   rate_limit_wait - waiting for the rate limiter before a request
+#   request         - sending a request and reading the response headers (and body
+#                     unless streamed)
+#   decode          - parsing json, including reading the body of streamed pages
+#   fetch_wait      - the stream waiting for its next page (zero when prefetched
+#                     pages are ready)
+#   transform       - pruning and transforming records
+#   write           - serializing and buffering RECORD messages
+#   bookmark        - updating bookmarks and writing STATE messages
+# transform and write are estimated from a sample of the records of each page.
+PHASES = ['rate_limit_wait', 'request', 'decode', 'fetch_wait', 'transform', 'write',
+          'bookmark']
+
+COUNTERS = ['http_request_count', 'retry_count', 'bytes_received', 'page_count']
+
+
+class StreamStats():
+    """
+    Seconds per phase and event counts of one stream, updated from the stream's
+    worker thread and from backfill and prefetch threads
+    """
+    def __init__(self, stream_name):
+        self.stream_name = stream_name
+        self.seconds = dict.fromkeys(PHASES, 0.0)
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        self.__lock = threading.Lock()
+
+    def add_seconds(self, phase, seconds):
+        with self.__lock:
+            self.seconds[phase] += seconds
+
+    def add(self, counter, value=1):
+        with self.__lock:
+            self.counts[counter] += value
+
+    @contextmanager
+    def timer(self, phase):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_seconds(phase, time.perf_counter() - started_at)
+
+    def emit(self):
+        """
+        Logs one METRIC line per phase and counter, tagged with the stream
+        """
+        with self.__lock:
+            seconds = dict(self.seconds)
+            counts = dict(self.counts)
+
+        for phase, value in seconds.items():
+            metrics.log(LOGGER, metrics.Point('timer',
+                                              'stream_phase_duration',
+                                              round(value, 6),
+                                              {metrics.Tag.endpoint: self.stream_name,
+                                               'phase': phase}))
+        for counter, value in counts.items():
+            metrics.log(LOGGER, metrics.Point('counter',
+                                              counter,
+                                              value,
+                                              {metrics.Tag.endpoint: self.stream_name}))
+
+
+_STATS = {}
+_STATS_LOCK = threading.Lock()
+
+
+def start_stats(stream_name):
+    with _STATS_LOCK:
+        if stream_name not in _STATS:
+            _STATS[stream_name] = StreamStats(stream_name)
+        return _STATS[stream_name]
+
+
+def get_stats(stream_name):
+    """
+    Returns the stats of a stream being instrumented. Other endpoints, e.g.
+    discovery's, get stats that are not kept, so the registry only ever holds
+    running streams.
+    """
+    with _STATS_LOCK:
+        return _STATS.get(stream_name) or StreamStats(stream_name)
+
+
+def pop_stats(stream_name):
+    with _STATS_LOCK:
+        return _STATS.pop(stream_name, None) or StreamStats(stream_name)
+
+
+def timed_pages(pages, stats):
+    """
+    Counts the pages of a stream and the time spent waiting for each of them
+    """
+    pages = iter(pages)
+    while True:
+        started_at = time.perf_counter()
+        try:
+            page = next(pages)
+        except StopIteration:
+            return
+        finally:
+            stats.add_seconds('fetch_wait', time.perf_counter() - started_at)
+        stats.add('page_count')
+        yield page
+
+
+@contextmanager
+def profile(name, profile_dir=None):
+    """
+    Runs the block under cProfile when `profile_dir` is set, writing the stats to
+    `<profile_dir>/<name>.prof` and logging the functions with the most own time.
+    cProfile only sees the calling thread, so each worker thread is profiled on
+    its own.
+    """
+    if not profile_dir:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        os.makedirs(profile_dir, exist_ok=True)
+        path = os.path.join(profile_dir, '{}.prof'.format(name))
+        profiler.dump_stats(path)
+
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats('tottime').print_stats(10)
+        LOGGER.info('{} - Profile written to {}\n{}'.format(name, path, summary.getvalue()))
+
+
+@contextmanager
+def instrument_stream(stream_name, profile_dir=None):
+    """
+    Collects the stats of a stream sync and emits them when it ends, whether
+    it succeeds or fails
+    """
+    try:
+        with profile(stream_name, profile_dir):
+            yield start_stats(stream_name)
+    finally:
+        pop_stats(stream_name).emit()
@@ -0,0 +1,143 @@
+import json
+import sys
+import threading
+import time
+
+import singer
+from singer.messages import format_message, RecordMessage
+
+# Serializes every Singer message written to stdout, and every mutation of the
+# shared state dict, so concurrent stream workers produce a valid message stream.
+LOCK = threading.RLock()
+
+
+DEFAULT_BUFFER_SIZE = 64 * 1024
+
+# The stdlib C encoder produces the same bytes as singer's simplejson encoder for
+# the types Deputy returns, about 1.5x faster.
+_RECORD_ENCODER = json.JSONEncoder(check_circular=False)
+
+
+def format_record(stream_name, record):
+    """
+    Serializes a RECORD message exactly as singer.write_record does
+    """
+    message = {
+        'type': 'RECORD',
+        'stream': stream_name,
+        'record': record
+    }
+    try:
+        return _RECORD_ENCODER.encode(message)
+    except TypeError:
+        # e.g. Decimal values, which only simplejson writes the way singer does
+        return format_message(RecordMessage(stream_name, record))
+
+
+class OutputWriter():
+    """
+    Buffers RECORD lines and writes them to stdout in blocks of about `buffer_size`
+    bytes. The buffer is flushed before any other message, so message order is
+    unchanged; a `buffer_size` of 0 writes and flushes every record.
+    """
+    def __init__(self, buffer_size=DEFAULT_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self.__lines = []
+        self.__size = 0
+
+    def write_record(self, stream_name, record):
+        line = format_record(stream_name, record) + '\n'
+        with LOCK:
+            self.__lines.append(line)
+            self.__size += len(line)
+            if self.__size >= self.buffer_size:
+                self.flush()
+
+    def flush(self):
+        with LOCK:
+            if self.__lines:
+                sys.stdout.write(''.join(self.__lines))
+                sys.stdout.flush()
+                self.__lines = []
+                self.__size = 0
+
+
+WRITER = OutputWriter()
+
+
+def write_schema(stream_name, schema, key_properties):
+    with LOCK:
+        WRITER.flush()
+        singer.write_schema(stream_name, schema, key_properties)
+
+
+def write_record(stream_name, record):
+    WRITER.write_record(stream_name, record)
+
+
+def flush():
+    WRITER.flush()
+
+
+class StateEmitter():
+    """
+    Coalesces bookmark updates into fewer STATE messages. Updates are flushed once
+    `flush_records` records or `flush_seconds` seconds have accumulated since the
+    last STATE; with neither set every update is written. Every STATE carries the
+    full state dict, which only references pages that were fully emitted, so any
+    flushed STATE is a correct resume point.
+    """
+    def __init__(self, flush_records=0, flush_seconds=0):
+        self.configure(flush_records, flush_seconds)
+
+    def configure(self, flush_records=0, flush_seconds=0):
+        with LOCK:
+            self.flush_records = flush_records
+            self.flush_seconds = flush_seconds
+            self.__pending = False
+            self.__records = 0
+            self.__written_at = time.monotonic()
+
+    def update(self, state, records=0):
+        with LOCK:
+            self.__pending = True
+            self.__records += records
+            if self.flush_records <= 0 and self.flush_seconds <= 0:
+                self.write(state)
+            elif 0 < self.flush_records <= self.__records or \
+                 0 < self.flush_seconds <= time.monotonic() - self.__written_at:
+                self.write(state)
+
+    def flush(self, state):
+        with LOCK:
+            if self.__pending:
+                self.write(state)
+
+    def write(self, state):
+        with LOCK:
+            WRITER.flush()
+            singer.write_state(state)
+            self.__pending = False
+            self.__records = 0
+            self.__written_at = time.monotonic()
+
+
+STATE_EMITTER = StateEmitter()
+
+
+def write_state(state):
+    """
+    Writes a STATE message immediately, including any coalesced updates
+    """
+    STATE_EMITTER.write(state)
+
+
+def update_state(state, records=0):
+    """
+    Records a bookmark change, written once the emitter's flush threshold is reached
+    """
+    STATE_EMITTER.update(state, records)
+
+
+def flush_state(state):
+    STATE_EMITTER.flush(state)
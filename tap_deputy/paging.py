@@ -0,0 +1,412 @@
+import queue
+import threading
+
+from requests.exceptions import ChunkedEncodingError, ConnectionError, Timeout
+from singer import get_logger
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
+
+from tap_deputy import utils
+from tap_deputy.client import Server5xxError
+
+LOGGER = get_logger()
+
+PAGE_SIZE = 500
+MIN_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 2000
+TARGET_SECONDS = 5
+TARGET_BYTES = 5 * 1024 * 1024
+
+PAGINATION_MODES = ['offset', 'keyset']
+
+# a streamed page failing with one of these while its body is read is requested
+# again, up to STREAMED_PAGE_ATTEMPTS times in all
+STREAM_ERRORS = (ChunkedEncodingError, ConnectionError, Timeout, ProtocolError,
+                 ReadTimeoutError)
+STREAMED_PAGE_ATTEMPTS = 3
+
+
+class PageSizer():
+    """
+    Chooses the `max` of each QUERY page. With `adaptive` set, the size doubles
+    while responses come back well under the latency and payload targets, halves
+    when either target is exceeded or a page request fails, and stays within
+    [minimum, maximum].
+    """
+    def __init__(self, size=PAGE_SIZE, minimum=MIN_PAGE_SIZE, maximum=MAX_PAGE_SIZE,
+                 adaptive=False, target_seconds=TARGET_SECONDS, target_bytes=TARGET_BYTES):
+        self.minimum = min(minimum, size)
+        self.maximum = max(maximum, size)
+        self.size = size
+        self.adaptive = adaptive
+        self.target_seconds = target_seconds
+        self.target_bytes = target_bytes
+        # most rows the server has returned in one page
+        self.confirmed = 0
+        self.__failed = False
+        self.__retry_smaller = False
+
+    @classmethod
+    def from_config(cls, config, stream_name):
+        """
+        Builds a sizer from the top level page size options, overridden by any
+        options set for the stream under `stream_page_sizes`
+        """
+        options = dict(config)
+        options.update(config.get('stream_page_sizes', {}).get(stream_name, {}))
+        return cls(size=utils.get_int(options, 'page_size', PAGE_SIZE),
+                   minimum=utils.get_int(options, 'min_page_size', MIN_PAGE_SIZE),
+                   maximum=utils.get_int(options, 'max_page_size', MAX_PAGE_SIZE),
+                   adaptive=utils.get_bool(options, 'adaptive_page_size'))
+
+    def shrink(self):
+        """
+        Halves the page size, returning False when it is already at the minimum
+        """
+        if self.size <= self.minimum:
+            return False
+        self.size = max(self.minimum, self.size // 2)
+        return True
+
+    def begin(self):
+        """
+        Starts a page request, which fail() shrinks at most once
+        """
+        self.__failed = False
+
+    def fail(self):
+        """
+        Halves the page size once per page request, however many of its retries
+        fail, returning False when it is already at the minimum
+        """
+        if not self.__failed:
+            self.__failed = True
+            self.__retry_smaller = self.shrink()
+        return self.__retry_smaller
+
+    def grow(self):
+        self.size = min(self.maximum, self.size * 2)
+
+    def observe(self, response):
+        self.__observe(response, lambda: len(response.content))
+
+    def observe_streamed(self, response):
+        # reading `content` would buffer the body, so rely on the declared length
+        self.__observe(response, lambda: int(response.headers.get('Content-Length') or 0))
+
+    def __observe(self, response, get_num_bytes):
+        if response.status_code >= 500:
+            self.fail()
+            return
+        if response.status_code >= 400:
+            return
+
+        seconds = response.elapsed.total_seconds()
+        num_bytes = get_num_bytes()
+        if seconds > self.target_seconds or num_bytes > self.target_bytes:
+            self.shrink()
+        elif seconds < self.target_seconds / 2 and num_bytes < self.target_bytes / 2:
+            self.grow()
+
+    def is_last_page(self, requested, received):
+        if not self.adaptive:
+            return received < requested
+        if received >= requested:
+            self.confirmed = max(self.confirmed, received)
+            return False
+        if received == 0 or requested <= self.confirmed:
+            return True
+
+        # A short page larger than any page the server has returned in full may be
+        # a server-side cap rather than the end of the data. Keep paging at the
+        # received size; an empty next page confirms the end.
+        self.maximum = max(received, self.confirmed)
+        self.size = min(self.size, self.maximum)
+        return False
+
+
+def modified_search(modified_type, last_datetime, end_datetime=None, filters=None):
+    """
+    Builds a QUERY search on Modified, with any extra `filters` clauses added
+    """
+    search = {
+        's1': {
+            'field': 'Modified',
+            'type': modified_type,
+            'data': last_datetime
+        }
+    }
+    if end_datetime is not None:
+        search['s2'] = {
+            'field': 'Modified',
+            'type': 'lt',
+            'data': end_datetime
+        }
+    search.update(filters or {})
+    return search
+
+
+class StreamedPage():
+    """
+    A page of records decoded while it is iterated. Its length and last record
+    are known once it has been fully iterated.
+
+    Errors reading the body come after the request's own retries. When the
+    connection drops mid-body, `request` is called for the page again and the
+    records already yielded are skipped.
+    """
+    def __init__(self, records, request=None):
+        self.__records = records
+        self.__request = request
+        self.__count = 0
+        self.__last = None
+
+    def __iter__(self):
+        records = self.__records
+        skip = 0
+        attempt = 1
+        while True:
+            try:
+                for record in records:
+                    if skip:
+                        skip -= 1
+                        continue
+                    self.__count += 1
+                    self.__last = record
+                    yield record
+                return
+            except STREAM_ERRORS as err:
+                if self.__request is None or attempt >= STREAMED_PAGE_ATTEMPTS:
+                    raise
+                attempt += 1
+                LOGGER.warning('Lost the connection reading a page, requesting it again: {}'.format(
+                    err))
+                records = self.__request()
+                skip = self.__count
+
+    def __len__(self):
+        return self.__count
+
+    def __getitem__(self, index):
+        if index != -1 or self.__count == 0:
+            raise IndexError('Only the last record of a streamed page is kept')
+        return self.__last
+
+
+def query_resource(client, resource_name, stream_name, search, sort, start, sizer,
+                   streaming=False):
+    """
+    Fetches one page, returning the records and the page size requested. When
+    the request still fails after retries, adaptive sizers retry with a smaller page.
+    With `streaming`, the records are a StreamedPage decoded as they are iterated.
+    """
+    kwargs = {}
+    if sizer.adaptive:
+        kwargs['response_hook'] = sizer.observe_streamed if streaming else sizer.observe
+    post = client.stream_post if streaming else client.post
+    while True:
+        count = sizer.size
+        body = {
+            'search': search,
+            'sort': sort,
+            'start': start,
+            'max': count
+        }
+
+        def request(body=body):
+            return post('/api/v1/resource/{}/QUERY'.format(resource_name),
+                        json=body,
+                        endpoint=stream_name,
+                        **kwargs)
+
+        sizer.begin()
+        try:
+            records = request()
+        except (Server5xxError, Timeout):
+            if not sizer.adaptive or not sizer.fail():
+                raise
+            LOGGER.warning('{} - Retrying page with max {}'.format(stream_name, sizer.size))
+            continue
+        if streaming:
+            records = StreamedPage(records, request)
+        return records, count
+
+
+def offset_pages(client, resource_name, stream_name, last_datetime, sizer=None,
+                 end_datetime=None, streaming=False, filters=None):
+    """
+    Yields pages of records modified at or after `last_datetime` (and before
+    `end_datetime` if set), advancing `start` by the number of records received.
+    """
+    sizer = sizer or PageSizer()
+    search = modified_search('ge', last_datetime, end_datetime, filters)
+    offset = 0
+    while True:
+        records, count = query_resource(client,
+                                        resource_name,
+                                        stream_name,
+                                        search,
+                                        {'Modified': 'asc'},
+                                        offset,
+                                        sizer,
+                                        streaming)
+        yield records
+
+        if sizer.is_last_page(count, len(records)):
+            return
+        offset += len(records)
+
+
+class KeysetPage():
+    """
+    Iterates a keyset page, dropping the rows at or before the (Modified, Id)
+    boundary that the previous page already emitted. Tracks the rows received,
+    the last row and how many trailing rows share its timestamp.
+    """
+    def __init__(self, records, boundary_modified=None, boundary_id=None):
+        self.__records = records
+        self.__boundary_modified = boundary_modified
+        self.__boundary_id = boundary_id
+        self.received = 0
+        self.last = None
+        self.ties = 0
+
+    def __iter__(self):
+        for record in self.__records:
+            self.received += 1
+            if self.last is not None and record['Modified'] == self.last['Modified']:
+                self.ties += 1
+            else:
+                self.ties = 1
+            self.last = record
+
+            if self.__boundary_id is not None and \
+               record['Modified'] == self.__boundary_modified and \
+               record['Id'] <= self.__boundary_id:
+                continue
+            yield record
+
+
+def keyset_pages(client, resource_name, stream_name, last_datetime, sizer=None,
+                 end_datetime=None, streaming=False, filters=None):
+    """
+    Yields pages of records modified at or after `last_datetime` (and before
+    `end_datetime` if set), ordered by
+    (Modified, Id) and always queried from `start` 0, so page cost does not grow
+    with depth.
+
+    After a full page ending at (Modified=m, Id=i), the next page is queried with
+    `Modified ge m` and the rows at or before (m, i) are dropped, so usually one
+    request is made per page. When most of a page shares m, the rows sharing it
+    are instead drained with `Modified eq m, Id gt i` before paging resumes with
+    `Modified gt m`, so a large group of rows with one timestamp is neither
+    skipped nor refetched page after page.
+    """
+    sizer = sizer or PageSizer()
+    cursor_modified = last_datetime
+    cursor_id = None
+    modified_type = 'ge'
+    draining = False
+    while True:
+        if draining:
+            search = {
+                's1': {
+                    'field': 'Modified',
+                    'type': 'eq',
+                    'data': cursor_modified
+                },
+                's2': {
+                    'field': 'Id',
+                    'type': 'gt',
+                    'data': cursor_id
+                }
+            }
+            search.update(filters or {})
+            sort = {'Id': 'asc'}
+        else:
+            search = modified_search(modified_type, cursor_modified, end_datetime, filters)
+            sort = {'Modified': 'asc', 'Id': 'asc'}
+
+        records, count = query_resource(client, resource_name, stream_name, search, sort, 0,
+                                        sizer, streaming)
+        # drained rows are all past the cursor, so only boundary rows need dropping
+        page = KeysetPage(records) if draining else \
+            KeysetPage(records, cursor_modified, cursor_id)
+        yield StreamedPage(iter(page)) if streaming else list(page)
+
+        if sizer.is_last_page(count, page.received):
+            if not draining:
+                return
+            # rows sharing the cursor timestamp are exhausted, move past it
+            draining = False
+            cursor_id = None
+            modified_type = 'gt'
+            continue
+
+        cursor_id = page.last['Id']
+        if not draining:
+            cursor_modified = page.last['Modified']
+            modified_type = 'ge'
+            draining = page.ties * 2 > page.received
+
+
+def get_pages(pagination, client, resource_name, stream_name, last_datetime, sizer=None,
+              end_datetime=None, streaming=False, filters=None):
+    """
+    Returns an iterator over the pages of records modified since `last_datetime`
+    that also match the `filters` search clauses.
+    Streamed pages must be fully iterated before the next page is requested.
+    """
+    if pagination == 'keyset':
+        return keyset_pages(client, resource_name, stream_name, last_datetime, sizer,
+                            end_datetime, streaming, filters)
+    if pagination == 'offset':
+        return offset_pages(client, resource_name, stream_name, last_datetime, sizer,
+                            end_datetime, streaming, filters)
+    raise Exception('Unknown pagination mode "{}", expected one of: {}'.format(
+        pagination, ', '.join(PAGINATION_MODES)))
+
+
+_END = object()
+
+
+def prefetch(pages, depth):
+    """
+    Iterates `pages` on a background thread, keeping up to `depth` pages fetched
+    ahead of the consumer, so the next request is in flight while the current
+    page is being emitted. Errors raised while fetching are re-raised to the consumer.
+    Pages are read whole before they are queued, so streamed pages are buffered.
+    """
+    buffer = queue.Queue(maxsize=depth)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for page in pages:
+                if not put((list(page), None)):
+                    return
+            put((_END, None))
+        except Exception as err: # pylint: disable=broad-except
+            put((None, err))
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            page, err = buffer.get()
+            if err is not None:
+                raise err
+            if page is _END:
+                return
+            yield page
+    finally:
+        stopped.set()
+        producer.join()
@@ -0,0 +1,95 @@
+from singer import get_logger, metadata
+
+from tap_deputy import output, paging, utils
+
+LOGGER = get_logger()
+
+STREAM_ORDERS = ['catalog', 'cost']
+
+# weight of the latest run in the moving average of a stream's duration
+DURATION_WEIGHT = 0.5
+
+
+def get_duration(state, stream_name):
+    return state.get('stream_durations', {}).get(stream_name)
+
+def record_duration(state, stream_name, seconds):
+    """
+    Folds the duration of a finished stream into the moving average kept in the
+    state, and writes the state
+    """
+    with output.LOCK:
+        durations = state.setdefault('stream_durations', {})
+        previous = durations.get(stream_name)
+        if previous is not None:
+            seconds = DURATION_WEIGHT * seconds + (1 - DURATION_WEIGHT) * previous
+        durations[stream_name] = round(seconds, 3)
+        output.write_state(state)
+
+def has_pending_records(client, stream, state, start_date):
+    """
+    Probes the resource with a one row QUERY for records modified after the
+    stream's bookmark. Rows at the bookmark itself were emitted by the last run.
+    """
+    stream_name = stream.tap_stream_id
+    resource_name = metadata.to_map(stream.metadata)[()]['tap-deputy.resource']
+    bookmark = state.get('bookmarks', {}).get(stream_name)
+    records = client.post(
+        '/api/v1/resource/{}/QUERY'.format(resource_name),
+        json={
+            'search': paging.modified_search('ge' if bookmark is None else 'gt',
+                                             bookmark or start_date),
+            'sort': {'Modified': 'asc'},
+            'start': 0,
+            'max': 1
+        },
+        endpoint=stream_name)
+    return len(records) > 0
+
+def estimate_costs(client, streams, state, start_date, max_workers):
+    """
+    Estimates the seconds each stream will take: 0 when the probe finds nothing
+    to sync, else the moving average of its past durations, or None when the
+    stream has never been timed
+    """
+    pending = {}
+
+    def probe(stream):
+        pending[stream.tap_stream_id] = has_pending_records(client, stream, state, start_date)
+
+    utils.run_in_pool(probe, streams, max_workers)
+
+    costs = {}
+    for stream in streams:
+        stream_name = stream.tap_stream_id
+        if not pending[stream_name] and stream_name not in state.get('backfills', {}):
+            costs[stream_name] = 0.0
+        else:
+            costs[stream_name] = get_duration(state, stream_name)
+    return costs
+
+def plan(client, streams, state, start_date, max_workers):
+    """
+    Orders streams largest first. Workers take the next stream as they free up,
+    so this is greedy longest-processing-time scheduling across the pool.
+    Streams that were never timed may be the largest, so they go first, and
+    streams with nothing to sync go last. Ties keep catalog order. The stream an
+    interrupted run was syncing stays first, so it resumes before the others.
+    """
+    currently_syncing = state.get('currently_syncing')
+    resumed = [stream for stream in streams if stream.tap_stream_id == currently_syncing]
+    streams = [stream for stream in streams if stream.tap_stream_id != currently_syncing]
+    costs = estimate_costs(client, streams, state, start_date, max_workers)
+
+    def sort_key(stream):
+        cost = costs[stream.tap_stream_id]
+        return (cost is not None, -(cost or 0))
+
+    ordered = sorted(streams, key=sort_key)
+    LOGGER.info('Stream plan (estimated seconds): {}'.format(', '.join(
+        ['{}=resumed'.format(stream.tap_stream_id) for stream in resumed] +
+        ['{}={}'.format(stream.tap_stream_id,
+                        '?' if costs[stream.tap_stream_id] is None
+                        else costs[stream.tap_stream_id])
+         for stream in ordered])))
+    return resumed + ordered
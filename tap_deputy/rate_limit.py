@@ -0,0 +1,93 @@
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+from singer import get_logger
+from singer.utils import now
+
+LOGGER = get_logger()
+
+
+class TokenBucket():
+    """
+    Client-side request scheduler. Callers take one token per request; tokens refill
+    at `rate` per second up to `burst`. A `rate` of None disables the bucket, but
+    pauses requested by the server through Retry-After are still honored.
+    """
+    def __init__(self, rate=None, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate or 1))
+        self.__tokens = float(self.burst)
+        self.__updated_at = time.monotonic()
+        self.__paused_until = 0.0
+        self.__lock = threading.Lock()
+
+    def try_acquire(self):
+        """
+        Takes a token without blocking. Returns 0 when one was taken, otherwise the
+        number of seconds to wait before trying again.
+        """
+        with self.__lock:
+            current = time.monotonic()
+            wait = self.__paused_until - current
+            if wait > 0:
+                return wait
+            if not self.rate:
+                return 0
+            self.__tokens = min(self.burst,
+                                self.__tokens + (current - self.__updated_at) * self.rate)
+            self.__updated_at = current
+            if self.__tokens >= 1:
+                self.__tokens -= 1
+                return 0
+            return (1 - self.__tokens) / self.rate
+
+    def acquire(self):
+        wait = self.try_acquire()
+        while wait > 0:
+            time.sleep(wait)
+            wait = self.try_acquire()
+
+    def pause(self, seconds):
+        """
+        Holds every caller of this bucket for `seconds`
+        """
+        with self.__lock:
+            self.__paused_until = max(self.__paused_until, time.monotonic() + seconds)
+            # nothing accrues while the server asks us to wait
+            self.__tokens = 0.0
+            self.__updated_at = self.__paused_until
+
+
+_BUCKETS = {}
+_BUCKETS_LOCK = threading.Lock()
+
+
+def get_rate_limiter(domain, rate=None, burst=None):
+    """
+    Returns the bucket shared by every client of `domain` in this process
+    """
+    burst = burst or max(1, int(rate or 1))
+    with _BUCKETS_LOCK:
+        bucket = _BUCKETS.get(domain)
+        if bucket is None or (bucket.rate, bucket.burst) != (rate, burst):
+            bucket = _BUCKETS[domain] = TokenBucket(rate, burst)
+        return bucket
+
+
+def parse_retry_after(value):
+    """
+    Returns the number of seconds requested by a Retry-After header, which holds
+    either a number of seconds or an HTTP date
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - now()).total_seconds())
+    except (TypeError, ValueError):
+        LOGGER.warning('Ignoring unparseable Retry-After header: {}'.format(value))
+        return None
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import singer
+from singer.catalog import Catalog
+
+from tap_deputy import utils
+from tap_deputy.client import DeputyClient
+from tap_deputy.sync import sync
+
+LOGGER = singer.get_logger()
+
+DEFAULT_MAX_PROCESSES = 4
+
+
+def get_tenant_paths(output_dir, name):
+    return (os.path.join(output_dir, '{}.singer'.format(name)),
+            os.path.join(output_dir, '{}.state.json'.format(name)))
+
+
+def get_tenant_name(tenant, config=None):
+    """
+    Returns the tenant's `name`, defaulting to the domain of its config
+    """
+    if tenant.get('name'):
+        return tenant['name']
+    return (config or utils.read_config(tenant['config']))['domain']
+
+
+def load_json(path, default):
+    if not path or not os.path.exists(path):
+        return default
+    with open(path, 'r') as json_file:
+        return json.load(json_file)
+
+
+def sync_tenant(tenant, output_dir, max_workers):
+    """
+    Syncs one tenant, writing its Singer messages to `<name>.singer` and its final
+    state to `<name>.state.json` in `output_dir`. The state is read from the
+    tenant's `state` path, or from the previous run's state file. Returns a summary
+    instead of raising, so one failing tenant does not stop the others.
+    """
+    config_path = tenant['config']
+    config = utils.read_config(config_path)
+    config.setdefault('max_workers', max_workers)
+    name = get_tenant_name(tenant, config)
+    messages_path, state_path = get_tenant_paths(output_dir, name)
+
+    catalog = Catalog.load(tenant['catalog']) if tenant.get('catalog') else None
+    state = load_json(tenant.get('state') or state_path, {})
+
+    LOGGER.info('{} - Starting tenant sync'.format(name))
+    stdout = sys.stdout
+    try:
+        with open(messages_path, 'w') as messages_file:
+            sys.stdout = messages_file
+            with DeputyClient(config, config_path, tenant.get('dev', False)) as client:
+                sync(client, catalog, state, config['start_date'], config)
+    except Exception as err: # pylint: disable=broad-except
+        LOGGER.exception('{} - Tenant sync failed'.format(name))
+        return {'name': name, 'status': 'failed', 'error': str(err)}
+    finally:
+        sys.stdout = stdout
+        utils.write_json_atomic(state_path, state)
+
+    LOGGER.info('{} - Finished tenant sync'.format(name))
+    return {'name': name, 'status': 'succeeded'}
+
+
+def run(tenants_config):
+    """
+    Syncs every tenant on a pool of worker processes. Workers are reused across
+    tenants, so each pays Python and module start up once. The `max_workers`
+    budget is split evenly between the processes; a tenant config can still set
+    its own `max_workers`.
+    """
+    tenants = tenants_config['tenants']
+    names = [get_tenant_name(tenant) for tenant in tenants]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise Exception('Tenants would share output and state files: {}. Give each '
+                        'tenant a distinct "name".'.format(', '.join(duplicates)))
+
+    output_dir = tenants_config.get('output_dir', '.')
+    max_processes = min(len(tenants) or 1,
+                        utils.get_int(tenants_config, 'max_processes', DEFAULT_MAX_PROCESSES))
+    max_workers = max(1, utils.get_int(tenants_config, 'max_workers', max_processes) //
+                      max_processes)
+
+    os.makedirs(output_dir, exist_ok=True)
+    LOGGER.info('Syncing {} tenants on {} processes with {} workers each'.format(
+        len(tenants), max_processes, max_workers))
+
+    with ProcessPoolExecutor(max_workers=max_processes) as executor:
+        futures = [executor.submit(sync_tenant, tenant, output_dir, max_workers)
+                   for tenant in tenants]
+        return [future.result() for future in futures]
+
+
+@singer.utils.handle_top_exception(LOGGER)
+def main():
+    parser = argparse.ArgumentParser(
+        description='Sync many Deputy tenants, each with its own config, catalog and state')
+    parser.add_argument('-c', '--config', required=True,
+                        help='Tenants config file: {"tenants": [{"config": ..., '
+                             '"catalog": ..., "state": ..., "name": ..., "dev": ...}], '
+                             '"output_dir": ..., '
+                             '"max_processes": ..., "max_workers": ...}')
+    args = parser.parse_args()
+
+    results = run(load_json(args.config, None))
+    json.dump(results, sys.stdout, indent=2)
+
+    failed = [result['name'] for result in results if result['status'] != 'succeeded']
+    if failed:
+        raise Exception('Tenant syncs failed: {}'.format(', '.join(failed)))
+
+
+if __name__ == '__main__':
+    main()
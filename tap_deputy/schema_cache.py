@@ -0,0 +1,79 @@
+import json
+import os
+import threading
+import time
+
+from singer import get_logger
+
+from tap_deputy import utils
+
+LOGGER = get_logger()
+
+DEFAULT_TTL = 24 * 60 * 60
+
+
+class SchemaCache():
+    """
+    On-disk cache of resource INFO responses, stored as one json file per
+    Deputy domain and keyed by resource name. Entries older than `ttl`
+    seconds are treated as missing and refetched.
+    """
+    def __init__(self, cache_dir, domain, ttl=DEFAULT_TTL, invalidate=False):
+        self.__path = os.path.join(cache_dir, '{}.json'.format(domain))
+        self.__ttl = ttl
+        self.__lock = threading.Lock()
+        self.__dirty = False
+
+        if invalidate:
+            LOGGER.info('Invalidating schema cache {}'.format(self.__path))
+            self.__entries = {}
+            self.__dirty = True
+        else:
+            self.__entries = self.__load()
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Returns a cache for the configured domain, or None when `schema_cache_dir` is unset
+        """
+        cache_dir = config.get('schema_cache_dir')
+        if not cache_dir:
+            return None
+
+        os.makedirs(cache_dir, exist_ok=True)
+        return cls(cache_dir,
+                   config['domain'],
+                   ttl=utils.get_int(config, 'schema_cache_ttl', DEFAULT_TTL),
+                   invalidate=utils.get_bool(config, 'schema_cache_invalidate'))
+
+    def __load(self):
+        try:
+            with open(self.__path, 'r') as cache_file:
+                return json.load(cache_file)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            LOGGER.warning('Ignoring unreadable schema cache {}'.format(self.__path))
+            return {}
+
+    def get(self, resource_name):
+        with self.__lock:
+            entry = self.__entries.get(resource_name)
+        if entry is None or time.time() - entry['fetched_at'] > self.__ttl:
+            return None
+        return entry['info']
+
+    def put(self, resource_name, info):
+        with self.__lock:
+            self.__entries[resource_name] = {
+                'fetched_at': time.time(),
+                'info': info
+            }
+            self.__dirty = True
+
+    def save(self):
+        with self.__lock:
+            if not self.__dirty:
+                return
+            utils.write_json_atomic(self.__path, self.__entries)
+            self.__dirty = False
@@ -0,0 +1,107 @@
+from singer.utils import strptime_to_utc
+
+from tap_deputy import paging
+
+# partition fields and the resources listing their values
+SHARD_RESOURCES = {
+    'OperationalUnit': 'OperationalUnit',
+    'Company': 'Company'
+}
+
+# rows whose partition value was not listed when the shards were built, e.g. a
+# site created since
+OTHER_SHARD = 'other'
+# rows without a partition value, which match neither `eq` nor `nn`
+NULL_SHARD = 'null'
+
+
+def get_partition_ids(client, resource_name, stream_name):
+    """
+    Returns the Id of every row of the partition resource
+    """
+    ids = []
+    start = 0
+    while True:
+        records = client.post(
+            '/api/v1/resource/{}/QUERY'.format(resource_name),
+            json={
+                'search': {
+                    's1': {
+                        'field': 'Id',
+                        'type': 'gt',
+                        'data': 0
+                    }
+                },
+                'sort': {'Id': 'asc'},
+                'start': start,
+                'max': paging.PAGE_SIZE
+            },
+            endpoint=stream_name)
+        ids.extend(record['Id'] for record in records)
+        if len(records) < paging.PAGE_SIZE:
+            return ids
+        start += len(records)
+
+
+def get_latest_modified(client, resource_name, stream_name):
+    """
+    Returns the latest Modified of the resource, or None when it has no rows. Rows
+    changed after this call are stamped at or after it.
+    """
+    records = client.post(
+        '/api/v1/resource/{}/QUERY'.format(resource_name),
+        json={
+            'search': {
+                's1': {
+                    'field': 'Id',
+                    'type': 'gt',
+                    'data': 0
+                }
+            },
+            'sort': {'Modified': 'desc'},
+            'start': 0,
+            'max': 1
+        },
+        endpoint=stream_name)
+    return records[0]['Modified'] if records else None
+
+
+def get_shards(field, ids):
+    """
+    Returns the search filters of each shard, keyed by shard: one per partition
+    value, one for every other value and one for rows without a value, so the
+    shards cover exactly the rows of the unsharded query
+    """
+    if not ids:
+        return {OTHER_SHARD: {}}
+
+    shards = {
+        str(partition_id): {
+            'shard': {
+                'field': field,
+                'type': 'eq',
+                'data': partition_id
+            }
+        }
+        for partition_id in ids
+    }
+    shards[OTHER_SHARD] = {
+        'shard': {
+            'field': field,
+            'type': 'nn',
+            'data': ids
+        }
+    }
+    shards[NULL_SHARD] = {
+        'shard': {
+            'field': field,
+            'type': 'is',
+            'data': None
+        }
+    }
+    return shards
+
+
+def earliest(values):
+    # Modified values carry the tenant's UTC offset, which changes with DST
+    return min(values, key=strptime_to_utc)
@@ -1,98 +1,495 @@
+import time
+from datetime import timedelta
+
 import singer
 from singer import metrics, metadata, Transformer
 from singer.bookmarks import set_currently_syncing
+from singer.utils import now, strptime_to_utc
 
+from tap_deputy import instrumentation, output, paging, planner, shards, utils
 from tap_deputy.discover import discover
+from tap_deputy.schema_cache import SchemaCache
 
 LOGGER = singer.get_logger()
 
+# off by default: Modified has one second resolution, so a row changed again
+# within the second it was emitted would be skipped
+DEFAULT_BOOKMARK_IDS_LIMIT = 0
+
+# process_records times one record in this many
+TIMING_SAMPLE = 16
+
 def get_bookmark(state, stream_name, default):
     return state.get('bookmarks', {}).get(stream_name, default)
 
-def write_bookmark(state, stream_name, value):
-    if 'bookmarks' not in state:
-        state['bookmarks'] = {}
-    state['bookmarks'][stream_name] = value
-    singer.write_state(state)
-
-def write_schema(stream):
-    schema = stream.schema.to_dict()
-    singer.write_schema(stream.tap_stream_id, schema, stream.key_properties)
-
-def process_records(stream, mdata, max_modified, records):
-    schema = stream.schema.to_dict()
-    with metrics.record_counter(stream.tap_stream_id) as counter:
-        for record in records:
-            if record['Modified'] > max_modified:
-                max_modified = record['Modified']
-
-            with Transformer() as transformer:
-                record = transformer.transform(record,
-                                               schema,
-                                               mdata)
-            singer.write_record(stream.tap_stream_id, record)
-            counter.increment()
-        return max_modified
-
-def sync_stream(client, catalog, state, start_date, stream, mdata):
+def write_bookmark(state, stream_name, value, records=0, ids=None):
+    """
+    Sets the stream bookmark. With `ids`, also records the Ids already emitted at
+    the bookmark timestamp, so the next run can skip them.
+    """
+    with instrumentation.get_stats(stream_name).timer('bookmark'), output.LOCK:
+        if 'bookmarks' not in state:
+            state['bookmarks'] = {}
+        state['bookmarks'][stream_name] = value
+        if ids is not None:
+            state.setdefault('bookmark_ids', {})[stream_name] = {
+                'modified': value,
+                'ids': encode_ids(ids)
+            }
+        output.update_state(state, records)
+
+def encode_ids(ids):
+    """
+    Encodes integer Ids as sorted [first, last] ranges, which keeps the runs of
+    consecutive Ids left by bulk edits small in the state
+    """
+    ranges = []
+    for record_id in sorted(ids):
+        if ranges and record_id == ranges[-1][1] + 1:
+            ranges[-1][1] = record_id
+        else:
+            ranges.append([record_id, record_id])
+    return ranges
+
+def decode_ids(ranges):
+    return {record_id for first, last in ranges for record_id in range(first, last + 1)}
+
+def get_bookmark_ids(state, stream_name, bookmark):
+    """
+    Returns the Ids emitted at the bookmark timestamp by the last run, if they
+    were recorded for the current bookmark
+    """
+    entry = state.get('bookmark_ids', {}).get(stream_name)
+    if entry is None or entry['modified'] != bookmark:
+        return set()
+    return decode_ids(entry['ids'])
+
+def write_schema(stream, schema):
+    output.write_schema(stream.tap_stream_id, schema, stream.key_properties)
+
+def get_projected_fields(schema, mdata):
+    """
+    Returns the fields the Transformer would keep: schema properties that are
+    automatic, or neither deselected nor unsupported
+    """
+    fields = set()
+    for field_name in schema.get('properties', {}):
+        breadcrumb = ('properties', field_name)
+        inclusion = metadata.get(mdata, breadcrumb, 'inclusion')
+        selected = metadata.get(mdata, breadcrumb, 'selected')
+        if inclusion == 'automatic' or \
+           (selected is not False and inclusion != 'unsupported'):
+            fields.add(field_name)
+    return fields
+
+class RecordPipeline():
+    """
+    Per-stream record processing state built once and reused for every page:
+    the schema dict, the projected fields, a single Transformer and a single
+    record counter.
+
+    Deputy's QUERY endpoint returns whole rows, so fields that are not selected
+    are pruned before transformation, and transform cost scales with the selected
+    columns rather than the width of the resource.
+
+    Rows modified at `bookmark` whose Id is in `emitted_ids` were emitted by the
+    last run and are skipped. Modified has one second resolution, so this also
+    skips a row changed again within that second. Only plain incremental syncs
+    pass emitted Ids; backfills and shards re-emit rows at their bookmarks.
+    `boundary_ids` collects up to `ids_limit` Ids of the rows at the latest
+    Modified seen, to be stored with the next bookmark.
+    """
+    def __init__(self, stream, mdata, bookmark=None, emitted_ids=None, ids_limit=0):
+        self.stream_name = stream.tap_stream_id
+        self.schema = stream.schema.to_dict()
+        self.mdata = mdata
+        self.fields = get_projected_fields(self.schema, mdata)
+        self.transformer = Transformer()
+        self.counter = metrics.record_counter(self.stream_name)
+        self.stats = instrumentation.get_stats(self.stream_name)
+        self.bookmark = bookmark
+        self.emitted_ids = emitted_ids or set()
+        self.boundary_ids = set(self.emitted_ids)
+        self.ids_limit = ids_limit
+        self.skipped = 0
+
+    def __enter__(self):
+        self.transformer.__enter__()
+        self.counter.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.counter.__exit__(exc_type, exc_value, traceback)
+        self.transformer.__exit__(exc_type, exc_value, traceback)
+
+def is_later(modified, other):
+    """
+    Compares Modified values, which carry the tenant's UTC offset. Values with
+    the same offset compare as strings; others, e.g. a bookmark formatted in UTC
+    or a value from the other side of a DST change, are parsed.
+    """
+    if modified[19:] == other[19:]:
+        return modified > other
+    return strptime_to_utc(modified) > strptime_to_utc(other)
+
+def process_records(pipeline, max_modified, records):
+    """
+    Transforms and writes records one at a time, so streamed pages are never held
+    whole. Transform and write are timed on the first record and every
+    TIMING_SAMPLE-th after it, and scaled to the page, which keeps the clock out
+    of most of the per-record path.
+    """
+    transform = pipeline.transformer.transform
+    write_record = output.write_record
+    stream_name = pipeline.stream_name
+    schema = pipeline.schema
+    fields = pipeline.fields
+    bookmark = pipeline.bookmark
+    emitted_ids = pipeline.emitted_ids
+    boundary_ids = pipeline.boundary_ids
+    ids_limit = pipeline.ids_limit
+    perf_counter = time.perf_counter
+    emitted = 0
+    sampled = 0
+    transform_seconds = 0.0
+    write_seconds = 0.0
+    started_at = perf_counter()
+    for record in records:
+        modified = record['Modified']
+        if modified != max_modified and is_later(modified, max_modified):
+            max_modified = modified
+            boundary_ids = set()
+        if modified == max_modified:
+            if modified == bookmark and record['Id'] in emitted_ids:
+                pipeline.skipped += 1
+                continue
+            if len(boundary_ids) < ids_limit:
+                boundary_ids.add(record['Id'])
+
+        emitted += 1
+        if (emitted - 1) % TIMING_SAMPLE:
+            record = {key: value for key, value in record.items() if key in fields}
+            # metadata filtering is already done by the projection
+            write_record(stream_name, transform(record, schema))
+            continue
+
+        sampled += 1
+        transform_started_at = perf_counter()
+        record = {key: value for key, value in record.items() if key in fields}
+        record = transform(record, schema)
+        write_started_at = perf_counter()
+        write_record(stream_name, record)
+        transform_seconds += write_started_at - transform_started_at
+        write_seconds += perf_counter() - write_started_at
+    loop_seconds = perf_counter() - started_at
+
+    pipeline.counter.increment(emitted)
+    pipeline.boundary_ids = boundary_ids
+    if sampled:
+        transform_seconds *= emitted / sampled
+        write_seconds *= emitted / sampled
+    pipeline.stats.add_seconds('transform', transform_seconds)
+    pipeline.stats.add_seconds('write', write_seconds)
+    if isinstance(records, paging.StreamedPage):
+        # the rest of the loop was spent reading and decoding the response body
+        pipeline.stats.add_seconds(
+            'decode', max(0.0, loop_seconds - transform_seconds - write_seconds))
+    return max_modified
+
+def get_stream_pages(client, config, resource_name, stream_name, last_datetime,
+                     end_datetime=None, filters=None):
+    pages = paging.get_pages(config.get('pagination', 'offset'),
+                             client,
+                             resource_name,
+                             stream_name,
+                             last_datetime,
+                             paging.PageSizer.from_config(config, stream_name),
+                             end_datetime=end_datetime,
+                             streaming=utils.get_bool(config, 'stream_records'),
+                             filters=filters)
+
+    prefetch_pages = utils.get_int(config, 'prefetch_pages', 0)
+    if prefetch_pages > 0:
+        pages = paging.prefetch(pages, prefetch_pages)
+    return instrumentation.timed_pages(pages, instrumentation.get_stats(stream_name))
+
+def format_datetime(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def get_backfill_windows(start_date, end, window_days):
+    windows = []
+    window_start = strptime_to_utc(start_date)
+    while window_start < end:
+        window_end = min(window_start + timedelta(days=window_days), end)
+        windows.append([format_datetime(window_start), format_datetime(window_end)])
+        window_start = window_end
+    return windows
+
+def get_backfill(state, stream_name, start_date, window_days):
+    """
+    Returns the backfill in progress for the stream, starting a new one when the
+    stream has no bookmark and `backfill_window_days` is set. A backfill records the
+    `end` of the whole range and the windows still `pending`, so an interrupted
+    backfill resumes with only the unfinished windows.
+    """
+    with output.LOCK:
+        backfill = state.get('backfills', {}).get(stream_name)
+        if backfill is not None or window_days <= 0 or \
+           get_bookmark(state, stream_name, None) is not None:
+            return backfill
+
+        end = now()
+        backfill = {
+            'end': format_datetime(end),
+            'pending': get_backfill_windows(start_date, end, window_days)
+        }
+        state.setdefault('backfills', {})[stream_name] = backfill
+        output.write_state(state)
+        return backfill
+
+def sync_backfill(client, state, stream, mdata, resource_name, backfill, config):
     stream_name = stream.tap_stream_id
-    last_datetime = get_bookmark(state, stream_name, start_date)
+    max_workers = utils.get_int(config, 'backfill_max_workers', 1)
 
-    LOGGER.info('{} - Syncing data since {}'.format(stream.tap_stream_id, last_datetime))
+    LOGGER.info('{} - Backfilling {} windows until {} with {} workers'.format(
+        stream_name, len(backfill['pending']), backfill['end'], max_workers))
+
+    def sync_window(window):
+        window_start, window_end = window
+        with instrumentation.profile('{}-{}'.format(stream_name, window_start[:10]),
+                                     config.get('profile_dir')), \
+             RecordPipeline(stream, mdata) as pipeline:
+            for records in get_stream_pages(client,
+                                            config,
+                                            resource_name,
+                                            stream_name,
+                                            window_start,
+                                            end_datetime=window_end):
+                process_records(pipeline, window_start, records)
+
+        # written at once, so an interrupted backfill never redoes a finished window
+        with output.LOCK:
+            backfill['pending'].remove(window)
+            output.write_state(state)
+
+    utils.run_in_pool(sync_window, list(backfill['pending']), max_workers)
 
-    write_schema(stream)
+    # every record modified before `end` has been emitted
+    with output.LOCK:
+        del state['backfills'][stream_name]
+        write_bookmark(state, stream_name, backfill['end'])
+
+def get_shard_starts(state, stream_name, stream_shards, default):
+    """
+    Returns the Modified each shard resumes from: its own bookmark, else the stream
+    bookmark. Rows of partition values that are no longer listed now fall in the
+    remainder shard, so it resumes from the earliest of their bookmarks too.
+    """
+    with output.LOCK:
+        bookmarks = state.get('shard_bookmarks', {}).get(stream_name, {})
+        stream_bookmark = get_bookmark(state, stream_name, default)
+        starts = {key: bookmarks.get(key, stream_bookmark) for key in stream_shards}
+        starts[shards.OTHER_SHARD] = shards.earliest(
+            [starts[shards.OTHER_SHARD]] +
+            [value for key, value in bookmarks.items() if key not in stream_shards])
+        state.setdefault('shard_bookmarks', {})[stream_name] = dict(starts)
+        return starts
+
+def write_shard_bookmark(state, stream_name, shard, value, records=0):
+    """
+    Advances one shard. The stream bookmark is the earliest shard bookmark, so
+    resuming from it never skips a record of a shard that is behind.
+    """
+    with output.LOCK:
+        bookmarks = state['shard_bookmarks'][stream_name]
+        bookmarks[shard] = value
+        write_bookmark(state, stream_name, shards.earliest(bookmarks.values()), records)
+
+def sync_shards(client, state, stream, mdata, resource_name, field, start_date, config):
+    stream_name = stream.tap_stream_id
+    if field not in shards.SHARD_RESOURCES:
+        raise Exception('Cannot shard {} by "{}", expected one of: {}'.format(
+            stream_name, field, ', '.join(shards.SHARD_RESOURCES)))
+
+    # read before any shard is queried, so every later change is stamped at or after it
+    latest_modified = shards.get_latest_modified(client, resource_name, stream_name)
+    partition_ids = shards.get_partition_ids(client, shards.SHARD_RESOURCES[field], stream_name)
+    stream_shards = shards.get_shards(field, partition_ids)
+    starts = get_shard_starts(state, stream_name, stream_shards, start_date)
+    max_workers = utils.get_int(config, 'shard_max_workers', 1)
+
+    LOGGER.info('{} - Syncing {} shards by {} with {} workers'.format(
+        stream_name, len(stream_shards), field, max_workers))
+
+    def sync_shard(shard):
+        last_datetime = starts[shard]
+        with instrumentation.profile('{}-{}'.format(stream_name, shard),
+                                     config.get('profile_dir')), \
+             RecordPipeline(stream, mdata) as pipeline:
+            max_modified = last_datetime
+            received = 0
+            for records in get_stream_pages(client,
+                                            config,
+                                            resource_name,
+                                            stream_name,
+                                            last_datetime,
+                                            filters=stream_shards[shard]):
+                max_modified = process_records(pipeline, max_modified, records)
+                received += len(records)
+
+                write_shard_bookmark(state, stream_name, shard, max_modified, len(records))
+
+        # A shard with nothing since its bookmark, e.g. an inactive site, moves up to
+        # the resource's latest Modified, so it does not hold back the stream bookmark
+        if received == 0 and latest_modified is not None and \
+           shards.earliest([last_datetime, latest_modified]) != latest_modified:
+            write_shard_bookmark(state, stream_name, shard, latest_modified)
+
+    utils.run_in_pool(sync_shard, list(stream_shards), max_workers)
+
+def sync_stream(client, catalog, state, start_date, stream, mdata, config=None):
+    config = config or {}
+    started_at = time.monotonic()
+    with instrumentation.instrument_stream(stream.tap_stream_id, config.get('profile_dir')):
+        sync_stream_records(client, state, start_date, stream, mdata, config)
+
+    if config.get('stream_order') == 'cost':
+        planner.record_duration(state, stream.tap_stream_id, time.monotonic() - started_at)
+
+def sync_stream_records(client, state, start_date, stream, mdata, config):
+    stream_name = stream.tap_stream_id
 
     root_metadata = mdata.get(())
     resource_name = root_metadata['tap-deputy.resource']
 
-    count = 500
-    offset = 0
-    has_more = True
-    max_modified = last_datetime
-    while has_more:
-        query_params = {
-            'search': {
-                's1': {
-                    'field': 'Modified',
-                    'type': 'ge',
-                    'data': last_datetime
-                }
-            },
-            'sort': {
-                'Modified': 'asc'
-            },
-            'start': offset,
-            'max': count
-        }
+    backfill = get_backfill(state,
+                            stream_name,
+                            start_date,
+                            utils.get_int(config, 'backfill_window_days', 0))
+    if backfill is not None:
+        write_schema(stream, stream.schema.to_dict())
+        sync_backfill(client, state, stream, mdata, resource_name, backfill, config)
+        return
 
-        records = client.post(
-            '/api/v1/resource/{}/QUERY'.format(resource_name),
-            json=query_params,
-            endpoint=stream_name)
+    shard_field = config.get('stream_shards', {}).get(stream_name)
+    if shard_field:
+        write_schema(stream, stream.schema.to_dict())
+        sync_shards(client, state, stream, mdata, resource_name, shard_field, start_date,
+                    config)
+        return
 
-        if len(records) < count:
-            has_more = False
-        else:
-            offset += count
+    last_datetime = get_bookmark(state, stream_name, start_date)
+
+    LOGGER.info('{} - Syncing data since {}'.format(stream.tap_stream_id, last_datetime))
+
+    ids_limit = utils.get_int(config, 'bookmark_ids_limit', DEFAULT_BOOKMARK_IDS_LIMIT)
+    with RecordPipeline(stream,
+                        mdata,
+                        last_datetime,
+                        get_bookmark_ids(state, stream_name, last_datetime),
+                        ids_limit) as pipeline:
+        write_schema(stream, pipeline.schema)
+
+        max_modified = last_datetime
+        for records in get_stream_pages(client,
+                                        config,
+                                        resource_name,
+                                        stream_name,
+                                        last_datetime):
+            max_modified = process_records(pipeline, max_modified, records)
+
+            write_bookmark(state,
+                           stream_name,
+                           max_modified,
+                           len(records),
+                           pipeline.boundary_ids if ids_limit > 0 else None)
+
+    if pipeline.skipped:
+        LOGGER.info('{} - Skipped {} records already emitted at {}'.format(
+            stream_name, pipeline.skipped, last_datetime))
+
+def update_current_stream(state, stream_name=None):
+    with output.LOCK:
+        set_currently_syncing(state, stream_name)
+        output.write_state(state)
 
-        max_modified = process_records(stream, mdata, max_modified, records)
+def sync_streams_concurrently(client, catalog, state, start_date, selected_streams, max_workers,
+                              config):
+    """
+    Syncs streams on a pool of worker threads sharing one client. `currently_syncing`
+    always points at the earliest started stream that has not finished yet, so an
+    interrupted run resumes from a stream whose bookmark may still be behind.
+    """
+    in_flight = []
 
-        write_bookmark(state, stream_name, max_modified)
+    def run(stream):
+        stream_name = stream.tap_stream_id
+        with output.LOCK:
+            in_flight.append(stream_name)
+            update_current_stream(state, in_flight[0])
 
-def update_current_stream(state, stream_name=None):  
-    set_currently_syncing(state, stream_name) 
-    singer.write_state(state)
+        mdata = metadata.to_map(stream.metadata)
+        sync_stream(client, catalog, state, start_date, stream, mdata, config)
+
+        with output.LOCK:
+            in_flight.remove(stream_name)
+            update_current_stream(state, in_flight[0] if in_flight else None)
+
+    utils.run_in_pool(run, selected_streams, max_workers)
+
+def sync(client, catalog, state, start_date, config=None):
+    config = config or {}
+    if utils.get_bool(config, 'stream_records') and utils.get_int(config, 'prefetch_pages', 0) > 0:
+        # prefetched pages are read whole, so streaming them would only add overhead
+        LOGGER.warning('stream_records is ignored when prefetch_pages is set')
+        config = dict(config, stream_records=False)
+    max_workers = utils.get_int(config, 'max_workers', 1)
+    output.STATE_EMITTER.configure(utils.get_int(config, 'state_flush_records', 0),
+                                   utils.get_float(config, 'state_flush_seconds', 0))
+    output.WRITER.buffer_size = utils.get_int(config,
+                                              'output_buffer_size',
+                                              output.DEFAULT_BUFFER_SIZE)
 
-def sync(client, catalog, state, start_date):
+    try:
+        sync_selected_streams(client, catalog, state, start_date, config, max_workers)
+    finally:
+        # never lose coalesced bookmarks or buffered records, including when a stream fails
+        output.flush_state(state)
+        output.flush()
+
+def sync_selected_streams(client, catalog, state, start_date, config, max_workers):
     if not catalog:
-        catalog = discover(client)
+        catalog = discover(client,
+                           utils.get_int(config, 'discover_max_workers', 1),
+                           SchemaCache.from_config(config))
         selected_streams = catalog.streams
     else:
         selected_streams = catalog.get_selected_streams(state)
 
-    for stream in selected_streams:
-        mdata = metadata.to_map(stream.metadata)
-        update_current_stream(state, stream.tap_stream_id)
-        sync_stream(client, catalog, state, start_date, stream, mdata)
+    stream_order = config.get('stream_order', 'catalog')
+    if stream_order == 'cost':
+        selected_streams = planner.plan(client,
+                                        list(selected_streams),
+                                        state,
+                                        start_date,
+                                        max_workers)
+    elif stream_order != 'catalog':
+        raise Exception('Unknown stream_order "{}", expected one of: {}'.format(
+            stream_order, ', '.join(planner.STREAM_ORDERS)))
+
+    if max_workers > 1:
+        LOGGER.info('Syncing streams with {} workers'.format(max_workers))
+        sync_streams_concurrently(client,
+                                  catalog,
+                                  state,
+                                  start_date,
+                                  list(selected_streams),
+                                  max_workers,
+                                  config)
+    else:
+        for stream in selected_streams:
+            mdata = metadata.to_map(stream.metadata)
+            update_current_stream(state, stream.tap_stream_id)
+            sync_stream(client, catalog, state, start_date, stream, mdata, config)
 
     update_current_stream(state)
@@ -1,4 +1,11 @@
 import json
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+
+# Serializes read-modify-write cycles of the config file within the process
+CONFIG_LOCK = threading.Lock()
 
 
 def read_config(config_path):
@@ -15,10 +22,77 @@ def read_config(config_path):
 
 def write_config(config_path, data):
     """
-    Updates the provided filepath with json format of the `data` object
+    Updates the provided filepath with json format of the `data` object. The file is
+    replaced atomically so concurrent readers never see a partial config.
     """
-    config = read_config(config_path)
-    config.update(data)
-    with open(config_path, 'w') as tap_config:
-        json.dump(config, tap_config, indent=2)
+    with CONFIG_LOCK:
+        config = read_config(config_path)
+        config.update(data)
+        write_json_atomic(config_path, config)
     return config
+
+
+def get_int(config, key, default):
+    """
+    Reads an integer option from the config, accepting numeric strings
+    """
+    value = config.get(key)
+    if value is None or value == '':
+        return default
+    return int(value)
+
+
+def get_bool(config, key, default=False):
+    """
+    Reads a boolean option from the config, accepting "true"/"false" strings
+    """
+    value = config.get(key)
+    if value is None or value == '':
+        return default
+    if isinstance(value, str):
+        return value.strip().lower() in ('true', '1', 'yes')
+    return bool(value)
+
+
+def write_json_atomic(path, data):
+    """
+    Writes `data` as json to a temp file next to `path` and renames it into
+    place, so readers never observe a partially written file
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as tmp_file:
+            json.dump(data, tmp_file, indent=2)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def run_in_pool(func, items, max_workers):
+    """
+    Calls `func` on every item on a pool of `max_workers` threads. On the first
+    failure, items that have not started yet are cancelled and the error is
+    raised once the running calls finish.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(func, item) for item in items]
+        done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+        for future in futures:
+            future.cancel()
+        for future in done:
+            future.result()
+        for future in futures:
+            if not future.cancelled():
+                future.result()
+
+
+def get_float(config, key, default):
+    """
+    Reads a numeric option from the config, accepting numeric strings
+    """
+    value = config.get(key)
+    if value is None or value == '':
+        return default
+    return float(value)
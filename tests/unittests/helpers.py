@@ -0,0 +1,135 @@
+"""
+Fixtures shared by the unit tests
+"""
+import functools
+import io
+import json
+import threading
+from contextlib import redirect_stdout
+
+import requests
+from singer.catalog import CatalogEntry, Schema
+from singer.utils import strptime_to_utc
+
+from tap_deputy.sync import sync
+
+test_config = {
+    "client_id": "client_id",
+    "client_secret": "client_secret",
+    "domain": "example.deputy.com",
+    "redirect_uri": "redirect_uri",
+    "refresh_token": "refresh_token",
+    "access_token": "access_token"
+}
+
+
+def get_stream_response(status_code, body, headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.raw = io.BytesIO(body)
+    response.headers.update(headers or {})
+    return response
+
+
+def make_stream(stream_name, resource_name):
+    return CatalogEntry(
+        stream=stream_name,
+        tap_stream_id=stream_name,
+        key_properties=['Id'],
+        schema=Schema.from_dict({
+            'type': 'object',
+            'properties': {
+                'Id': {'type': ['null', 'integer']},
+                'Modified': {'type': ['null', 'string'], 'format': 'date-time'}
+            }
+        }),
+        metadata=[
+            {'breadcrumb': [],
+             'metadata': {'tap-deputy.resource': resource_name, 'selected': True}},
+            {'breadcrumb': ['properties', 'Id'], 'metadata': {'inclusion': 'automatic'}},
+            {'breadcrumb': ['properties', 'Modified'], 'metadata': {'inclusion': 'available'}}
+        ])
+
+
+def make_records(count):
+    return [{'Id': i, 'Modified': '2021-01-01T00:00:{:02d}+00:00'.format(i % 60)}
+            for i in range(count)]
+
+
+OPERATORS = {
+    'eq': lambda a, b: a == b,
+    'nn': lambda a, b: a is not None and a not in b,
+    'gt': lambda a, b: a > b,
+    'ge': lambda a, b: a >= b,
+    'lt': lambda a, b: a < b,
+    'is': lambda a, b: a is None,
+}
+
+
+@functools.lru_cache(maxsize=None)
+def parse_modified(value):
+    return strptime_to_utc(value)
+
+
+def get_value(field, value):
+    # like Deputy, compare Modified as a point in time whatever its UTC offset
+    return parse_modified(value) if field == 'Modified' else value
+
+
+class MockClient:
+    """ Serves QUERY pages for each resource from an in-memory list."""
+
+    def __init__(self, data, fail_resource=None, fail_after=0):
+        self.data = data
+        self.fail_resource = fail_resource
+        self.fail_after = fail_after
+        self.calls = 0
+
+    def post(self, path, json=None, endpoint=None):
+        resource_name = path.split('/')[4]
+        if resource_name == self.fail_resource:
+            if self.fail_after <= 0:
+                raise Exception('Failed to query {}'.format(resource_name))
+            self.fail_after -= 1
+        rows = [row for row in self.data[resource_name]
+                if all(OPERATORS[clause['type']](get_value(clause['field'], row[clause['field']]),
+                                                 get_value(clause['field'], clause['data']))
+                       for clause in json['search'].values())]
+        for field, direction in reversed(list(json.get('sort', {}).items())):
+            rows.sort(key=lambda row: get_value(field, row[field]), reverse=direction == 'desc')
+        start = json['start']
+        return rows[start:start + json['max']]
+
+
+def run_sync(client, catalog, state, config):
+    stdout = io.StringIO()
+    with redirect_stdout(stdout):
+        try:
+            sync(client, catalog, state, '2021-01-01T00:00:00Z', config)
+        finally:
+            messages = [json.loads(line) for line in stdout.getvalue().splitlines()]
+    return messages
+
+
+class MockInfoClient:
+    """ Serves INFO responses, failing the first call for selected resources."""
+
+    def __init__(self, flaky_resources=(), broken_resources=(), fields=None):
+        self.fields = fields or {}
+        self.flaky_resources = set(flaky_resources)
+        self.broken_resources = set(broken_resources)
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def get(self, path, endpoint=None):
+        resource_name = path.split('/')[4]
+        with self.lock:
+            self.calls.append(resource_name)
+            if resource_name in self.flaky_resources:
+                self.flaky_resources.remove(resource_name)
+                raise Exception('Temporary failure')
+        if resource_name in self.broken_resources:
+            raise Exception('Permanent failure')
+        return {'fields': self.fields.get(resource_name,
+                                          {'Id': 'Integer', 'Modified': 'DateTime',
+                                           'Name': 'VarChar'})}
@@ -0,0 +1,43 @@
+import unittest
+
+from benchmarks.baseline import find_regressions
+from benchmarks.run import run_benchmark
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_benchmark_syncs_every_mock_record(self):
+        results = run_benchmark(records=1200,
+                                fields=8,
+                                resource_names=['Timesheet', 'Roster'],
+                                sync_config={'max_workers': 2, 'pagination': 'keyset'})
+
+        self.assertEqual(results['discover']['requests'], 59)
+        self.assertEqual(results['sync']['records'], 2400)
+        self.assertGreater(results['sync']['records_per_second'], 0)
+        self.assertIsNotNone(results['sync']['time_to_first_record_seconds'])
+        self.assertGreater(results['peak_rss_mb'], 0)
+
+
+class TestBaseline(unittest.TestCase):
+    def test_reports_metrics_past_the_tolerance(self):
+        baseline = {'parameters': {'runs': 10},
+                    'sync': {'seconds': 1.0, 'records_per_second': 1000.0}}
+        results = {'parameters': {'runs': 10},
+                   'sync': {'seconds': 1.1, 'records_per_second': 700.0}}
+        metrics = {'sync.seconds': False, 'sync.records_per_second': True}
+
+        regressions = find_regressions(results, baseline, metrics, 0.2)
+
+        self.assertEqual(len(regressions), 1)
+        self.assertTrue(regressions[0].startswith('sync.records_per_second'))
+
+    def test_rejects_a_baseline_with_other_parameters(self):
+        with self.assertRaises(Exception):
+            find_regressions({'parameters': {'runs': 5}}, {'parameters': {'runs': 10}}, {}, 0.2)
+
+    def test_any_increase_from_a_zero_baseline_is_reported(self):
+        baseline = {'parameters': {}, 'import': {'requests_per_run': 0.0}}
+        results = {'parameters': {}, 'import': {'requests_per_run': 1.0}}
+
+        self.assertEqual(len(find_regressions(results, baseline,
+                                              {'import.requests_per_run': False}, 0.2)), 1)
@@ -0,0 +1,242 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from datetime import timedelta
+from unittest import mock
+
+import requests
+from singer.utils import now, strftime
+
+from tap_deputy import client, rate_limit
+from tap_deputy.async_client import AsyncDeputyClient
+from tap_deputy.client import DeputyClient, Server429Error
+from helpers import get_stream_response, test_config
+
+class TestStreamPost(unittest.TestCase):
+    body = b'[{"Id": 1, "Rate": 1.5}, {"Id": 2, "Name": "b\\u00e9"}]'
+
+    @mock.patch('requests.Session.request')
+    @mock.patch('tap_deputy.client.DeputyClient.refresh')
+    def test_stream_post_yields_records(self, mocked_refresh, mocked_request):
+        mocked_request.return_value = get_stream_response(200, self.body)
+        deputy = DeputyClient(test_config, None, dev_mode=True)
+
+        records = list(deputy.stream_post('/api/v1/resource/Roster/QUERY', json={}))
+
+        self.assertEqual(records, [{'Id': 1, 'Rate': 1.5}, {'Id': 2, 'Name': 'bé'}])
+        self.assertTrue(mocked_request.call_args[1]['stream'])
+
+    @mock.patch('tap_deputy.client.ijson', None)
+    def test_buffered_fallback_without_ijson(self):
+        records = list(client.iter_json_items(get_stream_response(200, self.body)))
+
+        self.assertEqual(records, [{'Id': 1, 'Rate': 1.5}, {'Id': 2, 'Name': 'bé'}])
+
+
+class TestRateLimit(unittest.TestCase):
+    def test_bucket_spaces_requests_after_burst(self):
+        bucket = rate_limit.TokenBucket(rate=50, burst=5)
+        started_at = time.monotonic()
+        for _ in range(15):
+            bucket.acquire()
+
+        self.assertGreaterEqual(time.monotonic() - started_at, 0.18)
+
+    def test_pause_holds_callers(self):
+        bucket = rate_limit.TokenBucket()
+        bucket.pause(0.2)
+        started_at = time.monotonic()
+        bucket.acquire()
+
+        self.assertGreaterEqual(time.monotonic() - started_at, 0.15)
+
+    def test_clients_of_a_domain_share_a_bucket(self):
+        self.assertIs(rate_limit.get_rate_limiter('a.deputy.com', 10),
+                      rate_limit.get_rate_limiter('a.deputy.com', 10))
+        self.assertIsNot(rate_limit.get_rate_limiter('a.deputy.com', 10),
+                         rate_limit.get_rate_limiter('b.deputy.com', 10))
+
+    def test_parse_retry_after(self):
+        self.assertEqual(rate_limit.parse_retry_after('3'), 3.0)
+        self.assertEqual(rate_limit.parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT'), 0.0)
+        self.assertIsNone(rate_limit.parse_retry_after(None))
+        self.assertIsNone(rate_limit.parse_retry_after('soon'))
+
+    @mock.patch('backoff._sync.time')
+    @mock.patch('requests.Session.request')
+    @mock.patch('tap_deputy.client.DeputyClient.refresh')
+    def test_429_is_retried_after_retry_after(self, mocked_refresh, mocked_request,
+                                              mocked_time):
+        mocked_request.side_effect = [
+            get_stream_response(429, b'', {'Retry-After': '0.2'}),
+            get_stream_response(200, b'[]')
+        ]
+        deputy = DeputyClient(dict(test_config, domain='retry.deputy.com'), None,
+                              dev_mode=True)
+
+        started_at = time.monotonic()
+        self.assertEqual(deputy.post('/api/v1/resource/Roster/QUERY'), [])
+        self.assertGreaterEqual(time.monotonic() - started_at, 0.15)
+        self.assertEqual(mocked_request.call_count, 2)
+
+    @mock.patch('backoff._sync.time')
+    @mock.patch('requests.Session.request')
+    @mock.patch('tap_deputy.client.DeputyClient.refresh')
+    def test_429_gives_up_after_max_tries(self, mocked_refresh, mocked_request, mocked_time):
+        mocked_request.side_effect = [get_stream_response(429, b'') for _ in range(5)]
+        deputy = DeputyClient(test_config, None, dev_mode=True)
+
+        with self.assertRaises(Server429Error):
+            deputy.post('/api/v1/resource/Roster/QUERY')
+        self.assertEqual(mocked_request.call_count, 5)
+
+
+class TestSessionOptions(unittest.TestCase):
+    def test_pool_size_follows_concurrency(self):
+        self.assertEqual(client.get_pool_size({}), 10)
+        self.assertEqual(client.get_pool_size({'max_workers': 4,
+                                               'backfill_max_workers': 3,
+                                               'prefetch_pages': 1}), 24)
+        self.assertEqual(client.get_pool_size({'discover_max_workers': 16}), 16)
+
+    # autospec passes the session, whose headers carry Accept-Encoding
+    @mock.patch('requests.Session.request', autospec=True)
+    @mock.patch('tap_deputy.client.DeputyClient.refresh')
+    def test_requests_carry_timeouts_and_encoding(self, mocked_refresh, mocked_request):
+        mocked_request.return_value = get_stream_response(200, b'[]')
+        deputy = DeputyClient(dict(test_config, connect_timeout='5', request_timeout=60),
+                              None,
+                              dev_mode=True)
+        deputy.post('/api/v1/resource/Roster/QUERY')
+
+        session = mocked_request.call_args[0][0]
+        self.assertEqual(mocked_request.call_args[1]['timeout'], (5.0, 60.0))
+        self.assertEqual(session.headers['Accept-Encoding'], 'gzip, deflate')
+
+        deputy = DeputyClient(dict(test_config, accept_encoding='identity'), None, dev_mode=True)
+        deputy.post('/api/v1/resource/Roster/QUERY')
+
+        session = mocked_request.call_args[0][0]
+        self.assertEqual(session.headers['Accept-Encoding'], 'identity')
+
+    @mock.patch('backoff._sync.time')
+    @mock.patch('requests.Session.request')
+    @mock.patch('tap_deputy.client.DeputyClient.refresh')
+    def test_read_timeouts_are_retried(self, mocked_refresh, mocked_request, mocked_time):
+        mocked_request.side_effect = [requests.exceptions.ReadTimeout(),
+                                      get_stream_response(200, b'[]')]
+        deputy = DeputyClient(test_config, None, dev_mode=True)
+
+        self.assertEqual(deputy.post('/api/v1/resource/Roster/QUERY'), [])
+        self.assertEqual(mocked_request.call_count, 2)
+
+
+class TestTokenRefresh(unittest.TestCase):
+    def setUp(self):
+        fd, self.config_path = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(fd, 'w') as config_file:
+            json.dump(test_config, config_file)
+
+    def tearDown(self):
+        os.remove(self.config_path)
+
+    def refresh_response(self, *args, **kwargs):
+        time.sleep(0.05)
+        return {'refresh_token': 'new_refresh_token',
+                'access_token': 'new_access_token',
+                'expires_in': 86400}
+
+    @mock.patch('requests.Session.request')
+    @mock.patch('tap_deputy.client.DeputyClient.post')
+    def test_stored_valid_token_skips_refresh(self, mocked_post, mocked_request):
+        mocked_request.return_value = get_stream_response(200, b'{}')
+        config = dict(test_config, expires_at=strftime(now() + timedelta(hours=1)))
+        deputy = DeputyClient(config, self.config_path, dev_mode=False)
+        deputy.get('/api/v1/resource/Contact/INFO')
+
+        self.assertEqual(mocked_post.call_count, 0)
+
+    @mock.patch('requests.Session.request')
+    @mock.patch('tap_deputy.client.DeputyClient.post')
+    def test_stored_expired_token_is_refreshed(self, mocked_post, mocked_request):
+        mocked_request.return_value = get_stream_response(200, b'{}')
+        mocked_post.side_effect = self.refresh_response
+        config = dict(test_config, expires_at=strftime(now() - timedelta(hours=1)))
+        deputy = DeputyClient(config, self.config_path, dev_mode=False)
+        deputy.get('/api/v1/resource/Contact/INFO')
+
+        self.assertEqual(mocked_post.call_count, 1)
+        self.assertEqual(deputy.access_token, 'new_access_token')
+
+    @mock.patch('requests.Session.request')
+    @mock.patch('tap_deputy.client.DeputyClient.post')
+    def test_concurrent_callers_share_one_refresh(self, mocked_post, mocked_request):
+        mocked_request.side_effect = lambda *args, **kwargs: get_stream_response(200, b'{}')
+        mocked_post.side_effect = self.refresh_response
+        deputy = DeputyClient(test_config, self.config_path, dev_mode=False)
+
+        threads = [threading.Thread(target=deputy.get, args=('/api/v1/resource/Contact/INFO',))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(mocked_post.call_count, 1)
+        with open(self.config_path) as config_file:
+            self.assertEqual(json.load(config_file)['refresh_token'], 'new_refresh_token')
+
+    @mock.patch('backoff._sync.time')
+    @mock.patch('requests.Session.request')
+    @mock.patch('tap_deputy.client.DeputyClient.post')
+    def test_401_forces_a_refresh(self, mocked_post, mocked_request, mocked_time):
+        mocked_request.side_effect = [get_stream_response(401, b''),
+                                      get_stream_response(200, b'{}')]
+        mocked_post.side_effect = self.refresh_response
+        config = dict(test_config, expires_at=strftime(now() + timedelta(hours=1)))
+        deputy = DeputyClient(config, self.config_path, dev_mode=False)
+        deputy.get('/api/v1/resource/Contact/INFO')
+
+        self.assertEqual(mocked_post.call_count, 1)
+        self.assertEqual(mocked_request.call_args[1]['headers']['Authorization'],
+                         'OAuth new_access_token')
+
+    @mock.patch('requests.Session.request')
+    def test_rejected_refresh_token_raises(self, mocked_request):
+        mocked_request.return_value = get_stream_response(401, b'{"error": "invalid_grant"}')
+        deputy = DeputyClient(test_config, self.config_path, dev_mode=False)
+        errors = []
+
+        def get():
+            try:
+                deputy.get('/api/v1/resource/Contact/INFO')
+            except Exception as err: # pylint: disable=broad-except
+                errors.append(err)
+
+        thread = threading.Thread(target=get, daemon=True)
+        thread.start()
+        thread.join(timeout=3)
+
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(len(errors), 1)
+        self.assertIn('refresh token', str(errors[0]))
+        self.assertEqual(mocked_request.call_count, 1)
+
+    @mock.patch('aiohttp.ClientSession.request')
+    def test_async_rejected_refresh_token_raises(self, mocked_request):
+        response = mock.MagicMock(status=401, headers={})
+        response.text = mock.AsyncMock(return_value='{"error": "invalid_grant"}')
+        mocked_request.return_value.__aenter__.return_value = response
+        config = dict(test_config, access_token=None)
+
+        async def get():
+            async with AsyncDeputyClient(config, self.config_path, dev_mode=False) as deputy:
+                await deputy.get('/api/v1/resource/Contact/INFO')
+
+        with self.assertRaisesRegex(Exception, 'refresh token'):
+            asyncio.run(asyncio.wait_for(get(), timeout=3))
+        self.assertEqual(mocked_request.call_count, 1)
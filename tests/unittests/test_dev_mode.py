@@ -27,6 +27,7 @@ class Mockresponse:
         self.status_code = status_code
         self.raise_error = raise_error
         self.text = text
+        self.content = text.encode('utf-8')
 
     def raise_for_status(self):
         if not self.raise_error:
@@ -123,16 +124,16 @@ class TestDevMode(unittest.TestCase):
     @mock.patch('time.sleep')
     @mock.patch('requests.Session.request')
     def test_dev_mode_disabled_token_expired(self, mocked_post_request, mock_sleep):
-        retry_count = 5
-        mocked_post_request.side_effect = [get_response(401, raise_error = True)] * retry_count
+        mocked_post_request.side_effect = [get_response(401, raise_error = True)]
         deputy = DeputyClient(config=test_config,
                               config_path=test_config_path,
                               dev_mode=False)
 
-        with self.assertRaises(Server401TokenExpiredError) as e:
+        # a rejected refresh token is not retried, the same token would be rejected again
+        with self.assertRaises(Exception) as e:
             deputy.request("POST",
                            "/oauth/access_token",
                            auth_call=True)
 
-        # Verify the call count for each error
-        self.assertEquals(mocked_post_request.call_count, retry_count)
\ No newline at end of file
+        self.assertNotIsInstance(e.exception, Server401TokenExpiredError)
+        self.assertEquals(mocked_post_request.call_count, 1)
\ No newline at end of file
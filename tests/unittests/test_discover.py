@@ -0,0 +1,181 @@
+import asyncio
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from singer import metadata
+
+from tap_deputy.async_client import discover_with_asyncio
+from tap_deputy.client import AUTH_PROBE_RESOURCE
+from tap_deputy.discover import discover, discover_async, refresh_catalog, RESOURCES
+from tap_deputy.schema_cache import SchemaCache
+from helpers import MockInfoClient
+
+
+class TestDiscover(unittest.TestCase):
+    def test_concurrent_discover_keeps_resource_order(self):
+        catalog = discover(MockInfoClient(), max_workers=8)
+
+        self.assertEqual([stream.tap_stream_id for stream in catalog.streams],
+                         list(RESOURCES.values()))
+
+    def test_failed_resource_is_retried_alone(self):
+        client = MockInfoClient(flaky_resources=['Timesheet'])
+        catalog = discover(client, max_workers=8)
+
+        self.assertEqual(len(catalog.streams), len(RESOURCES))
+        self.assertEqual(client.calls.count('Timesheet'), 2)
+        self.assertEqual(len(client.calls), len(RESOURCES) + 1)
+
+    def test_persistent_failure_raises(self):
+        with self.assertRaises(Exception):
+            discover(MockInfoClient(broken_resources=['Roster']), max_workers=8)
+
+
+class AsyncMockClient(MockInfoClient):
+    """ Awaitable variant of MockInfoClient that tracks the peak number of calls in flight."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    async def get(self, path, endpoint=None):
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.001)
+            return super().get(path, endpoint)
+        finally:
+            self.in_flight -= 1
+
+
+class TestDiscoverAsync(unittest.TestCase):
+    def test_async_discover_matches_discover(self):
+        client = AsyncMockClient()
+        catalog = asyncio.run(discover_async(client, max_workers=10))
+
+        self.assertEqual(catalog.to_dict(), discover(MockInfoClient()).to_dict())
+        self.assertEqual(client.peak_in_flight, 10)
+
+    def test_async_failed_resource_is_retried_alone(self):
+        client = AsyncMockClient(flaky_resources=['Timesheet'])
+        catalog = asyncio.run(discover_async(client, max_workers=10))
+
+        self.assertEqual(len(catalog.streams), len(RESOURCES))
+        self.assertEqual(client.calls.count('Timesheet'), 2)
+
+    @mock.patch('tap_deputy.async_client.AsyncDeputyClient')
+    def test_asyncio_discovery_reuses_the_auth_probe(self, mocked_client):
+        client = AsyncMockClient()
+        mocked_client.return_value.__aenter__.return_value = client
+
+        catalog = discover_with_asyncio({}, None, False, max_workers=10)
+
+        self.assertEqual(client.calls[0], AUTH_PROBE_RESOURCE)
+        self.assertEqual(client.calls.count(AUTH_PROBE_RESOURCE), 1)
+        self.assertEqual(len(catalog.streams), len(RESOURCES))
+
+    @mock.patch('tap_deputy.async_client.AsyncDeputyClient')
+    def test_asyncio_discovery_reports_a_failed_auth_probe(self, mocked_client):
+        mocked_client.return_value.__aenter__.return_value = AsyncMockClient(
+            broken_resources=[AUTH_PROBE_RESOURCE])
+
+        with self.assertRaisesRegex(Exception, 'Error testing Deputy authentication'):
+            discover_with_asyncio({}, None, False, max_workers=10)
+
+
+class TestRefreshCatalog(unittest.TestCase):
+    def select(self, catalog, stream_name, field_name):
+        entry = catalog.get_stream(stream_name)
+        mdata = metadata.to_map(entry.metadata)
+        mdata = metadata.write(mdata, (), 'selected', True)
+        mdata = metadata.write(mdata, ('properties', field_name), 'selected', True)
+        entry.metadata = metadata.to_list(mdata)
+
+    def test_unchanged_catalog_is_kept(self):
+        catalog = discover(MockInfoClient())
+        self.select(catalog, 'timesheets', 'Name')
+
+        refreshed, changes = refresh_catalog(MockInfoClient(), catalog)
+
+        self.assertEqual(refreshed.to_dict(), catalog.to_dict())
+        self.assertEqual(changes, {})
+
+    def test_changed_fields_are_reported_and_selections_kept(self):
+        catalog = discover(MockInfoClient())
+        self.select(catalog, 'timesheets', 'Name')
+
+        client = MockInfoClient(fields={'Timesheet': {'Id': 'Integer', 'Name': 'VarChar',
+                                                      'Cost': 'Float'}})
+        refreshed, changes = refresh_catalog(client, catalog)
+
+        self.assertEqual(changes, {'timesheets': {'added': ['Cost'], 'removed': ['Modified']}})
+        mdata = metadata.to_map(refreshed.get_stream('timesheets').metadata)
+        self.assertTrue(mdata[()]['selected'])
+        self.assertTrue(mdata[('properties', 'Name')]['selected'])
+        self.assertNotIn('selected', mdata[('properties', 'Cost')])
+        self.assertEqual([entry.tap_stream_id for entry in refreshed.streams],
+                         list(RESOURCES.values()))
+
+
+class TestSchemaCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def make_cache(self, **kwargs):
+        return SchemaCache.from_config(dict({'domain': 'example.deputy.com',
+                                             'schema_cache_dir': self.cache_dir},
+                                            **kwargs))
+
+    def test_cache_disabled_without_dir(self):
+        self.assertIsNone(SchemaCache.from_config({'domain': 'example.deputy.com'}))
+
+    def test_second_discover_served_from_cache(self):
+        discover(MockInfoClient(), cache=self.make_cache())
+
+        client = MockInfoClient()
+        catalog = discover(client, cache=self.make_cache())
+
+        self.assertEqual(client.calls, [])
+        self.assertEqual(len(catalog.streams), len(RESOURCES))
+
+    def test_stale_entries_are_refetched(self):
+        discover(MockInfoClient(), cache=self.make_cache())
+
+        client = MockInfoClient()
+        with mock.patch('time.time', return_value=time.time() + 7200):
+            discover(client, cache=self.make_cache(schema_cache_ttl='3600'))
+
+        self.assertEqual(len(client.calls), len(RESOURCES))
+
+    def test_invalidate_flag_refetches(self):
+        discover(MockInfoClient(), cache=self.make_cache())
+
+        client = MockInfoClient()
+        discover(client, cache=self.make_cache(schema_cache_invalidate='true'))
+
+        self.assertEqual(len(client.calls), len(RESOURCES))
+
+    def test_failed_discover_keeps_completed_entries(self):
+        with self.assertRaises(Exception):
+            discover(MockInfoClient(broken_resources=['Roster']), cache=self.make_cache())
+
+        client = MockInfoClient()
+        discover(client, cache=self.make_cache())
+
+        self.assertEqual(client.calls, ['Roster'])
+
+    def test_refresh_with_fresh_cache_makes_no_requests(self):
+        catalog = discover(MockInfoClient(), cache=self.make_cache())
+
+        client = MockInfoClient()
+        refreshed, _ = refresh_catalog(client, catalog, cache=self.make_cache())
+
+        self.assertEqual(client.calls, [])
+        self.assertEqual(refreshed.to_dict(), catalog.to_dict())
@@ -0,0 +1,82 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from singer.catalog import Catalog
+
+from tap_deputy import instrumentation
+from tap_deputy.client import DeputyClient
+from helpers import MockClient, get_stream_response, make_records, make_stream, run_sync, test_config
+
+
+def get_points(mocked_log):
+    # singer reconfigures logging on every get_logger call, so capture the points
+    return [call[0][1] for call in mocked_log.call_args_list]
+
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.data = {'Roster': make_records(1200), 'Country': make_records(3)}
+        self.catalog = Catalog([make_stream('rosters', 'Roster'),
+                                make_stream('countries', 'Country')])
+
+    @mock.patch('tap_deputy.instrumentation.metrics.log')
+    def test_phase_metrics_emitted_per_stream(self, mocked_log):
+        run_sync(MockClient(self.data), self.catalog, {}, {'max_workers': 2})
+
+        points = get_points(mocked_log)
+        phases = {(p.tags['endpoint'], p.tags['phase'])
+                  for p in points if p.metric == 'stream_phase_duration'}
+        self.assertEqual(phases, {(stream_name, phase)
+                                  for stream_name in ['rosters', 'countries']
+                                  for phase in instrumentation.PHASES})
+
+        page_counts = {p.tags['endpoint']: p.value
+                       for p in points if p.metric == 'page_count'}
+        self.assertEqual(page_counts, {'rosters': 3, 'countries': 1})
+
+    @mock.patch('tap_deputy.instrumentation.metrics.log')
+    def test_metrics_emitted_when_stream_fails(self, mocked_log):
+        with self.assertRaises(Exception):
+            run_sync(MockClient(self.data, fail_resource='Roster', fail_after=1),
+                     self.catalog, {}, {})
+
+        page_counts = {p.tags['endpoint']: p.value
+                       for p in get_points(mocked_log) if p.metric == 'page_count'}
+        self.assertEqual(page_counts, {'rosters': 1})
+
+    def test_profile_dir_writes_a_profile_per_stream(self):
+        with tempfile.TemporaryDirectory() as profile_dir:
+            run_sync(MockClient(self.data), self.catalog, {}, {'profile_dir': profile_dir})
+
+            self.assertEqual(sorted(os.listdir(profile_dir)),
+                             ['countries.prof', 'rosters.prof'])
+
+    @mock.patch('backoff._sync.time')
+    @mock.patch('requests.Session.request')
+    @mock.patch('tap_deputy.client.DeputyClient.refresh')
+    def test_client_counts_requests_retries_and_bytes(self, mocked_refresh, mocked_request,
+                                                      mocked_time):
+        mocked_request.side_effect = [get_stream_response(503, b''),
+                                      get_stream_response(200, b'[{"Id": 1}]')]
+        deputy = DeputyClient(test_config, None, dev_mode=True)
+        instrumentation.start_stats('instrumented_rosters')
+
+        deputy.post('/api/v1/resource/Roster/QUERY', endpoint='instrumented_rosters')
+
+        stats = instrumentation.pop_stats('instrumented_rosters')
+        self.assertEqual(stats.counts['http_request_count'], 2)
+        self.assertEqual(stats.counts['retry_count'], 1)
+        self.assertEqual(stats.counts['bytes_received'], 11)
+        self.assertGreater(stats.seconds['request'], 0)
+
+    @mock.patch('requests.Session.request')
+    @mock.patch('tap_deputy.client.DeputyClient.refresh')
+    def test_stats_are_only_kept_for_running_streams(self, mocked_refresh, mocked_request):
+        mocked_request.return_value = get_stream_response(200, b'{"fields": {}}')
+        deputy = DeputyClient(test_config, None, dev_mode=True)
+
+        deputy.get('/api/v1/resource/Contact/INFO', endpoint='resource_info')
+
+        self.assertNotIn('resource_info', instrumentation._STATS)
@@ -0,0 +1,51 @@
+import io
+import unittest
+from contextlib import redirect_stdout
+from decimal import Decimal
+
+import singer
+from singer.messages import format_message, RecordMessage
+
+from tap_deputy import output
+
+
+class TestOutput(unittest.TestCase):
+    records = [
+        {'Id': 1, 'Name': 'Zoë "Z" O\'Neil\n', 'Rate': 27.35, 'Active': True, 'Note': None},
+        {'Id': 2, 'Cost': 1e-07, 'Big': 2 ** 70, 'Nested': {'a': [1, 2.5, 'x']}},
+        {'Id': 3, 'Emoji': '\U0001f600', 'Control': '\x07\t', 'Amount': Decimal('10.10')},
+        {}
+    ]
+
+    def test_records_serialize_like_singer(self):
+        for record in self.records:
+            self.assertEqual(output.format_record('timesheets', record),
+                             format_message(RecordMessage('timesheets', record)))
+
+    def test_buffered_output_matches_singer_output(self):
+        def write_messages(write_record):
+            stdout = io.StringIO()
+            with redirect_stdout(stdout):
+                output.write_schema('timesheets', {'type': 'object'}, ['Id'])
+                for i in range(2000):
+                    write_record('timesheets', dict(self.records[i % 3], Id=i))
+                    if i % 700 == 0:
+                        output.write_state({'bookmarks': {'timesheets': i}})
+                output.flush()
+            return stdout.getvalue()
+
+        expected = write_messages(singer.write_record)
+        for buffer_size in (0, 100, output.DEFAULT_BUFFER_SIZE):
+            output.WRITER.buffer_size = buffer_size
+            self.assertEqual(write_messages(output.write_record), expected)
+        output.WRITER.buffer_size = output.DEFAULT_BUFFER_SIZE
+
+    def test_records_are_flushed_before_state(self):
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            output.write_record('timesheets', {'Id': 1})
+            self.assertEqual(stdout.getvalue(), '')
+            output.write_state({'bookmarks': {}})
+
+        self.assertEqual([line.split('"')[3] for line in stdout.getvalue().splitlines()],
+                         ['RECORD', 'STATE'])
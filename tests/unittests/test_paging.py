@@ -0,0 +1,282 @@
+import unittest
+from datetime import timedelta
+
+from requests.exceptions import ChunkedEncodingError
+
+from tap_deputy import paging
+from tap_deputy.client import Server5xxError
+
+OPERATORS = {
+    'eq': lambda a, b: a == b,
+    'gt': lambda a, b: a > b,
+    'ge': lambda a, b: a >= b,
+    'lt': lambda a, b: a < b,
+}
+
+
+class QueryClient:
+    """ Evaluates QUERY search, sort, start and max over an in-memory table."""
+
+    def __init__(self, rows, server_max=None, fail_above=None):
+        self.rows = rows
+        self.queries = []
+        self.server_max = server_max
+        self.fail_above = fail_above
+
+    def post(self, path, json=None, endpoint=None, response_hook=None):
+        self.queries.append(json)
+        if self.fail_above and json['max'] > self.fail_above:
+            raise Server5xxError()
+        rows = [row for row in self.rows
+                if all(OPERATORS[clause['type']](row[clause['field']], clause['data'])
+                       for clause in json['search'].values())]
+        for field in reversed(list(json['sort'].keys())):
+            rows.sort(key=lambda row: row[field])
+        count = min(json['max'], self.server_max or json['max'])
+        page = rows[json['start']:json['start'] + count]
+        if response_hook:
+            response_hook(MockResponse(200, seconds=0.1, body=b'[]'))
+        return page
+
+    def stream_post(self, path, **kwargs):
+        return iter(self.post(path, **kwargs))
+
+
+class DroppingQueryClient(QueryClient):
+    """ Drops the connection after `drop_after` rows of the first `drops` streamed pages."""
+
+    def __init__(self, rows, drop_after, drops=1):
+        super().__init__(rows)
+        self.drop_after = drop_after
+        self.drops = drops
+
+    def stream_post(self, path, **kwargs):
+        page = self.post(path, **kwargs)
+        if self.drops <= 0:
+            return iter(page)
+        self.drops -= 1
+        return self.drop(page)
+
+    def drop(self, page):
+        yield from page[:self.drop_after]
+        raise ChunkedEncodingError('Connection broken')
+
+
+class MockResponse:
+    def __init__(self, status_code, seconds=0.1, body=b''):
+        self.status_code = status_code
+        self.elapsed = timedelta(seconds=seconds)
+        self.content = body
+
+
+def make_rows(timestamps):
+    return [{'Id': i + 1, 'Modified': modified} for i, modified in enumerate(timestamps)]
+
+
+def collect(pages):
+    return [row['Id'] for page in pages for row in page]
+
+
+class TestPaging(unittest.TestCase):
+    def test_keyset_matches_offset(self):
+        rows = make_rows(['2021-01-01T00:00:{:02d}'.format(i % 37) for i in range(250)])
+
+        offset_ids = collect(paging.offset_pages(QueryClient(rows), 'Roster', 'rosters',
+                                                 '2021-01-01T00:00:00', sizer=paging.PageSizer(20)))
+        keyset_ids = collect(paging.keyset_pages(QueryClient(rows), 'Roster', 'rosters',
+                                                 '2021-01-01T00:00:00', sizer=paging.PageSizer(20)))
+
+        self.assertEqual(sorted(offset_ids), sorted(keyset_ids))
+        self.assertEqual(len(keyset_ids), len(set(keyset_ids)))
+
+    def test_keyset_never_uses_offsets(self):
+        client = QueryClient(make_rows(['2021-01-01T00:00:{:02d}'.format(i) for i in range(50)]))
+        collect(paging.keyset_pages(client, 'Roster', 'rosters', '2021-01-01',
+                                    sizer=paging.PageSizer(10)))
+
+        self.assertTrue(all(query['start'] == 0 for query in client.queries))
+
+    def test_keyset_drains_rows_sharing_a_timestamp(self):
+        # far more rows share one timestamp than fit in a page
+        rows = make_rows(['2021-01-01T00:00:00'] * 3 +
+                         ['2021-01-01T00:00:05'] * 45 +
+                         ['2021-01-01T00:00:09'] * 2)
+
+        ids = collect(paging.keyset_pages(QueryClient(rows), 'Roster', 'rosters',
+                                          '2021-01-01', sizer=paging.PageSizer(10)))
+
+        self.assertEqual(ids, list(range(1, 51)))
+
+    def test_keyset_makes_one_request_per_page(self):
+        client = QueryClient(make_rows(['2021-01-01T00:00:{:02d}'.format(i) for i in range(50)]))
+        ids = collect(paging.keyset_pages(client, 'Roster', 'rosters', '2021-01-01',
+                                          sizer=paging.PageSizer(10)))
+
+        self.assertEqual(ids, list(range(1, 51)))
+        # five full pages and one page holding only the boundary row
+        self.assertEqual(len(client.queries), 6)
+
+    def test_filters_apply_to_every_page(self):
+        rows = [dict(row, OperationalUnit=row['Id'] % 2)
+                for row in make_rows(['2021-01-01T00:00:00'] * 30 +
+                                     ['2021-01-01T00:00:{:02d}'.format(i) for i in range(30)])]
+        filters = {'shard': {'field': 'OperationalUnit', 'type': 'eq', 'data': 1}}
+
+        for pagination in paging.PAGINATION_MODES:
+            ids = collect(paging.get_pages(pagination, QueryClient(rows), 'Roster', 'rosters',
+                                           '2021-01-01', sizer=paging.PageSizer(4),
+                                           filters=filters))
+            self.assertEqual(sorted(ids), list(range(1, 61, 2)))
+
+    def test_keyset_skips_rows_before_bookmark(self):
+        rows = make_rows(['2021-01-01', '2021-01-02', '2021-01-03'])
+
+        ids = collect(paging.keyset_pages(QueryClient(rows), 'Roster', 'rosters',
+                                          '2021-01-02', sizer=paging.PageSizer(10)))
+
+        self.assertEqual(ids, [2, 3])
+
+    def test_streamed_pages_match_buffered_pages(self):
+        rows = make_rows(['2021-01-01T00:00:{:02d}'.format(i % 7) for i in range(95)])
+
+        for pagination in paging.PAGINATION_MODES:
+            buffered = collect(paging.get_pages(pagination, QueryClient(rows), 'Roster',
+                                                'rosters', '2021-01-01',
+                                                sizer=paging.PageSizer(10)))
+            streamed = collect(paging.get_pages(pagination, QueryClient(rows), 'Roster',
+                                                'rosters', '2021-01-01',
+                                                sizer=paging.PageSizer(10), streaming=True))
+            self.assertEqual(buffered, streamed)
+
+    def test_streamed_page_is_requested_again_when_the_connection_drops(self):
+        rows = make_rows(['2021-01-01T00:00:{:02d}'.format(i % 7) for i in range(25)])
+
+        for pagination in paging.PAGINATION_MODES:
+            client = DroppingQueryClient(rows, drop_after=4)
+            ids = collect(paging.get_pages(pagination, client, 'Roster', 'rosters', '2021-01-01',
+                                           sizer=paging.PageSizer(10), streaming=True))
+
+            self.assertEqual(sorted(ids), list(range(1, 26)))
+            self.assertEqual(len(ids), 25)
+            self.assertEqual(client.queries[0], client.queries[1])
+
+    def test_streamed_page_fails_after_its_attempts(self):
+        rows = make_rows(['2021-01-01T00:00:00'] * 5)
+        client = DroppingQueryClient(rows, drop_after=2, drops=paging.STREAMED_PAGE_ATTEMPTS)
+
+        with self.assertRaises(ChunkedEncodingError):
+            collect(paging.get_pages('offset', client, 'Roster', 'rosters', '2021-01-01',
+                                     sizer=paging.PageSizer(10), streaming=True))
+
+    def test_unknown_mode_raises(self):
+        with self.assertRaises(Exception):
+            paging.get_pages('cursor', QueryClient([]), 'Roster', 'rosters', '2021-01-01')
+
+
+class TestPageSizer(unittest.TestCase):
+    def test_fast_small_responses_grow_to_maximum(self):
+        sizer = paging.PageSizer(100, minimum=50, maximum=400, adaptive=True)
+        for _ in range(5):
+            sizer.observe(MockResponse(200, seconds=0.1, body=b'x' * 100))
+
+        self.assertEqual(sizer.size, 400)
+
+    def test_slow_or_large_responses_shrink_to_minimum(self):
+        sizer = paging.PageSizer(400, minimum=50, maximum=400, adaptive=True)
+        sizer.observe(MockResponse(200, seconds=30))
+        sizer.observe(MockResponse(200, body=b'x' * (paging.TARGET_BYTES + 1)))
+        sizer.begin()
+        sizer.observe(MockResponse(503))
+        sizer.begin()
+        sizer.observe(MockResponse(503))
+
+        self.assertEqual(sizer.size, 50)
+
+    def test_adaptive_pages_are_not_cut_short_by_a_server_cap(self):
+        rows = make_rows(['2021-01-01T00:00:{:02d}'.format(i % 60) for i in range(1234)])
+        for pages in (paging.offset_pages, paging.keyset_pages):
+            client = QueryClient(rows, server_max=500)
+            ids = collect(pages(client, 'Roster', 'rosters', '2021-01-01',
+                                sizer=paging.PageSizer(100, maximum=1000, adaptive=True)))
+            self.assertEqual(sorted(ids), list(range(1, 1235)))
+
+    def test_failed_page_is_retried_smaller(self):
+        client = QueryClient(make_rows(['2021-01-01'] * 30), fail_above=100)
+        ids = collect(paging.offset_pages(client, 'Roster', 'rosters', '2021-01-01',
+                                          sizer=paging.PageSizer(400, adaptive=True)))
+
+        self.assertEqual(ids, list(range(1, 31)))
+        # no page has come back full, so the short one is only ended by an empty page
+        self.assertEqual([query['max'] for query in client.queries], [400, 200, 100, 30])
+
+    def test_failed_attempts_of_one_page_shrink_once(self):
+        sizer = paging.PageSizer(400, minimum=50, adaptive=True)
+        sizer.begin()
+        for _ in range(3):
+            sizer.observe(MockResponse(503))
+
+        self.assertEqual(sizer.size, 200)
+
+        sizer.begin()
+        sizer.observe(MockResponse(503))
+        self.assertEqual(sizer.size, 100)
+
+    def test_initial_size_above_a_server_cap_is_not_trusted(self):
+        rows = make_rows(['2021-01-01T00:00:{:02d}'.format(i % 60) for i in range(700)])
+        client = QueryClient(rows, server_max=200)
+        ids = collect(paging.offset_pages(client, 'Roster', 'rosters', '2021-01-01',
+                                          sizer=paging.PageSizer(500, adaptive=True)))
+
+        self.assertEqual(sorted(ids), list(range(1, 701)))
+
+    def test_failed_page_is_raised_without_adaptive(self):
+        client = QueryClient(make_rows(['2021-01-01'] * 30), fail_above=100)
+        with self.assertRaises(Server5xxError):
+            collect(paging.offset_pages(client, 'Roster', 'rosters', '2021-01-01',
+                                        sizer=paging.PageSizer(400)))
+
+    def test_stream_overrides(self):
+        config = {'page_size': '200',
+                  'stream_page_sizes': {'states': {'page_size': 1000,
+                                                   'max_page_size': 5000,
+                                                   'adaptive_page_size': 'true'}}}
+
+        sizer = paging.PageSizer.from_config(config, 'states')
+        self.assertEqual((sizer.size, sizer.maximum, sizer.adaptive), (1000, 5000, True))
+
+        sizer = paging.PageSizer.from_config(config, 'comments')
+        self.assertEqual((sizer.size, sizer.adaptive), (200, False))
+
+
+class TestPrefetch(unittest.TestCase):
+    def test_prefetch_yields_pages_in_order(self):
+        rows = make_rows(['2021-01-01T00:00:{:02d}'.format(i % 60) for i in range(95)])
+        def pages():
+            return paging.offset_pages(QueryClient(rows), 'Roster', 'rosters', '2021-01-01',
+                                       sizer=paging.PageSizer(10))
+
+        self.assertEqual(collect(paging.prefetch(pages(), 2)), collect(pages()))
+
+    def test_prefetch_raises_fetch_errors(self):
+        def pages():
+            yield [{'Id': 1}]
+            raise Server5xxError()
+
+        prefetched = paging.prefetch(pages(), 2)
+        self.assertEqual(next(prefetched), [{'Id': 1}])
+        with self.assertRaises(Server5xxError):
+            next(prefetched)
+
+    def test_prefetch_stays_bounded_when_consumer_stops(self):
+        fetched = []
+
+        def pages():
+            for i in range(100):
+                fetched.append(i)
+                yield [{'Id': i}]
+
+        prefetched = paging.prefetch(pages(), 2)
+        next(prefetched)
+        prefetched.close()
+
+        self.assertLessEqual(len(fetched), 5)
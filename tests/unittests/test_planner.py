@@ -0,0 +1,75 @@
+import unittest
+
+from singer.catalog import Catalog
+
+from tap_deputy import planner
+from helpers import MockClient, make_records, make_stream, run_sync
+
+
+class TestPlanner(unittest.TestCase):
+    def setUp(self):
+        self.data = {'Roster': make_records(120),
+                     'Timesheet': make_records(30),
+                     'Country': make_records(3),
+                     'Comment': []}
+        self.streams = [make_stream('comments', 'Comment'),
+                        make_stream('timesheets', 'Timesheet'),
+                        make_stream('rosters', 'Roster'),
+                        make_stream('countries', 'Country')]
+
+    def test_plan_orders_largest_first(self):
+        state = {'stream_durations': {'timesheets': 5.0, 'rosters': 50.0, 'comments': 80.0}}
+
+        ordered = planner.plan(MockClient(self.data), self.streams, state,
+                               '2021-01-01T00:00:00Z', 2)
+
+        # never timed first, nothing pending last
+        self.assertEqual([stream.tap_stream_id for stream in ordered],
+                         ['countries', 'rosters', 'timesheets', 'comments'])
+
+    def test_interrupted_stream_stays_first(self):
+        state = {'currently_syncing': 'comments',
+                 'stream_durations': {'timesheets': 5.0, 'rosters': 50.0, 'comments': 80.0}}
+
+        ordered = planner.plan(MockClient(self.data), self.streams, state,
+                               '2021-01-01T00:00:00Z', 2)
+
+        self.assertEqual([stream.tap_stream_id for stream in ordered],
+                         ['comments', 'countries', 'rosters', 'timesheets'])
+
+    def test_streams_with_nothing_after_the_bookmark_cost_nothing(self):
+        state = {'bookmarks': {'rosters': '2021-01-01T00:00:59Z'},
+                 'stream_durations': {'rosters': 50.0}}
+
+        costs = planner.estimate_costs(MockClient(self.data), self.streams[2:3], state,
+                                       '2021-01-01T00:00:00Z', 1)
+
+        self.assertEqual(costs, {'rosters': 0.0})
+
+    def test_durations_recorded_as_moving_average(self):
+        state = {'stream_durations': {'rosters': 10.0}}
+
+        run_sync(MockClient(self.data), Catalog(self.streams), state,
+                 {'stream_order': 'cost', 'max_workers': 2})
+
+        self.assertEqual(set(state['stream_durations']),
+                         {'comments', 'timesheets', 'rosters', 'countries'})
+        self.assertLess(state['stream_durations']['rosters'], 10.0)
+        self.assertGreaterEqual(state['stream_durations']['rosters'], 5.0)
+
+    def test_duration_written_when_the_stream_finishes(self):
+        messages = run_sync(MockClient(self.data), Catalog(self.streams), {},
+                            {'stream_order': 'cost'})
+
+        # the state carrying each duration is written before the next stream starts
+        states = [m['value'] for m in messages if m['type'] == 'STATE']
+        for stream in self.streams:
+            self.assertTrue(any(
+                state.get('currently_syncing') == stream.tap_stream_id and
+                stream.tap_stream_id in state.get('stream_durations', {})
+                for state in states))
+
+    def test_unknown_stream_order_raises(self):
+        with self.assertRaises(Exception):
+            run_sync(MockClient(self.data), Catalog(self.streams), {},
+                     {'stream_order': 'random'})
@@ -0,0 +1,124 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from singer.catalog import Catalog
+
+from tap_deputy import runner
+
+
+class MockClient:
+    def __init__(self, config, config_path, dev_mode):
+        self.domain = config['domain']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def post(self, path, json=None, endpoint=None):
+        if self.domain == 'broken.deputy.com':
+            raise Exception('Service unavailable')
+        rows = [{'Id': i, 'Modified': '2021-01-0{}T00:00:00Z'.format(i)} for i in range(1, 4)]
+        return rows[json['start']:json['start'] + json['max']]
+
+
+class TestRunner(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.output_dir = os.path.join(self.tmp_dir, 'out')
+        os.makedirs(self.output_dir)
+        catalog = Catalog.from_dict({'streams': [{
+            'stream': 'rosters',
+            'tap_stream_id': 'rosters',
+            'key_properties': ['Id'],
+            'schema': {'type': 'object',
+                       'properties': {'Id': {'type': ['null', 'integer']},
+                                      'Modified': {'type': ['null', 'string']}}},
+            'metadata': [{'breadcrumb': [],
+                          'metadata': {'tap-deputy.resource': 'Roster', 'selected': True}}]
+        }]})
+        self.catalog_path = self.write_json('catalog.json', catalog.to_dict())
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_json(self, name, data):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'w') as json_file:
+            json.dump(data, json_file)
+        return path
+
+    def make_tenant(self, domain, name=None):
+        tenant = {'config': self.write_json((name or domain) + '.json',
+                                            {'domain': domain,
+                                             'start_date': '2021-01-01T00:00:00Z'}),
+                  'catalog': self.catalog_path}
+        if name:
+            tenant['name'] = name
+        return tenant
+
+    def read_messages(self, name):
+        path, _ = runner.get_tenant_paths(self.output_dir, name)
+        with open(path) as messages_file:
+            return [json.loads(line) for line in messages_file]
+
+    @mock.patch('tap_deputy.runner.DeputyClient', MockClient)
+    def test_tenant_output_and_state_are_separate(self):
+        for domain in ('a.deputy.com', 'b.deputy.com'):
+            result = runner.sync_tenant(self.make_tenant(domain), self.output_dir, 2)
+            self.assertEqual(result['status'], 'succeeded')
+
+            records = [m for m in self.read_messages(domain) if m['type'] == 'RECORD']
+            self.assertEqual(len(records), 3)
+
+            _, state_path = runner.get_tenant_paths(self.output_dir, domain)
+            state = runner.load_json(state_path, None)
+            self.assertEqual(state['bookmarks']['rosters'], '2021-01-03T00:00:00Z')
+
+    @mock.patch('tap_deputy.runner.DeputyClient', MockClient)
+    def test_previous_state_is_resumed(self):
+        tenant = self.make_tenant('a.deputy.com')
+        runner.sync_tenant(tenant, self.output_dir, 1)
+        runner.sync_tenant(tenant, self.output_dir, 1)
+
+        states = [m for m in self.read_messages('a.deputy.com') if m['type'] == 'STATE']
+        self.assertEqual(states[0]['value']['bookmarks']['rosters'], '2021-01-03T00:00:00Z')
+
+    @mock.patch('tap_deputy.runner.DeputyClient', MockClient)
+    def test_failed_tenant_is_reported(self):
+        result = runner.sync_tenant(self.make_tenant('broken.deputy.com'), self.output_dir, 1)
+
+        self.assertEqual(result['status'], 'failed')
+        self.assertIn('Service unavailable', result['error'])
+
+    # sync_tenant redirects sys.stdout, so threads stand in for processes one at a time
+    @mock.patch('tap_deputy.runner.ProcessPoolExecutor', ThreadPoolExecutor)
+    @mock.patch('tap_deputy.runner.DeputyClient', MockClient)
+    def test_run_syncs_named_tenants_of_one_domain(self):
+        tenants = [self.make_tenant('a.deputy.com', 'a-payroll'),
+                   self.make_tenant('a.deputy.com', 'a-rostering')]
+
+        results = runner.run({'tenants': tenants,
+                              'output_dir': self.output_dir,
+                              'max_processes': 1})
+
+        self.assertEqual(results, [{'name': 'a-payroll', 'status': 'succeeded'},
+                                   {'name': 'a-rostering', 'status': 'succeeded'}])
+        for name in ('a-payroll', 'a-rostering'):
+            records = [m for m in self.read_messages(name) if m['type'] == 'RECORD']
+            self.assertEqual(len(records), 3)
+
+    def test_run_rejects_tenants_sharing_a_name(self):
+        tenants = [self.make_tenant('a.deputy.com'),
+                   self.make_tenant('a.deputy.com', 'a-rostering'),
+                   self.make_tenant('a.deputy.com')]
+
+        with self.assertRaises(Exception) as context:
+            runner.run({'tenants': tenants, 'output_dir': self.output_dir})
+        self.assertIn('a.deputy.com', str(context.exception))
@@ -0,0 +1,82 @@
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+
+from singer.catalog import Catalog
+
+import tap_deputy
+from tap_deputy.discover import RESOURCES
+from helpers import MockInfoClient
+
+# modules only the modes that need them may import
+LAZY_MODULES = ['aiohttp', 'tap_deputy.async_client', 'tap_deputy.discover', 'tap_deputy.sync']
+
+test_config = {
+    'start_date': '2021-01-01T00:00:00Z',
+    'domain': 'example.deputy.com',
+    'client_id': 'client_id',
+    'client_secret': 'client_secret',
+    'redirect_uri': 'redirect_uri',
+    'refresh_token': 'refresh_token'
+}
+
+
+class TestStartup(unittest.TestCase):
+    def test_import_skips_lazy_modules(self):
+        loaded = subprocess.run(
+            [sys.executable, '-c',
+             'import json, sys, tap_deputy; '
+             'print(json.dumps([m for m in {} if m in sys.modules]))'.format(LAZY_MODULES)],
+            check=True, stdout=subprocess.PIPE).stdout
+
+        self.assertEqual(json.loads(loaded), [])
+
+    def test_discover_reuses_the_auth_probe(self):
+        client = MockInfoClient()
+        with redirect_stdout(io.StringIO()) as stdout:
+            tap_deputy.do_discover(client, {})
+
+        self.assertEqual(client.calls.count(tap_deputy.AUTH_PROBE_RESOURCE), 1)
+        self.assertEqual(len(client.calls), len(RESOURCES))
+        self.assertEqual(len(json.loads(stdout.getvalue())['streams']), len(RESOURCES))
+
+    @mock.patch('tap_deputy.DeputyClient')
+    def test_check_only_tests_authentication(self, mocked_client):
+        client = MockInfoClient()
+        mocked_client.return_value.__enter__.return_value = client
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config_path = os.path.join(tmp_dir, 'config.json')
+            with open(config_path, 'w') as config_file:
+                json.dump(test_config, config_file)
+
+            with mock.patch.object(sys, 'argv', ['tap-deputy', '-c', config_path, '--check']), \
+                 redirect_stdout(io.StringIO()) as stdout:
+                tap_deputy.main()
+
+        self.assertEqual(client.calls, [tap_deputy.AUTH_PROBE_RESOURCE])
+        self.assertEqual(stdout.getvalue(), '')
+
+    @mock.patch('tap_deputy.async_client.discover_with_asyncio')
+    @mock.patch('tap_deputy.DeputyClient')
+    def test_asyncio_discovery_skips_the_threaded_client(self, mocked_client, mocked_discover):
+        mocked_discover.return_value = Catalog([])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config_path = os.path.join(tmp_dir, 'config.json')
+            with open(config_path, 'w') as config_file:
+                json.dump(dict(test_config, discover_backend='asyncio'), config_file)
+
+            with mock.patch.object(sys, 'argv', ['tap-deputy', '-c', config_path, '--discover']), \
+                 redirect_stdout(io.StringIO()) as stdout:
+                tap_deputy.main()
+
+        self.assertEqual(mocked_discover.call_count, 1)
+        self.assertEqual(mocked_client.call_count, 0)
+        self.assertEqual(json.loads(stdout.getvalue()), {'streams': []})
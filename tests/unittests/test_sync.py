@@ -0,0 +1,378 @@
+import copy
+import unittest
+from unittest import mock
+
+from singer.catalog import Catalog, CatalogEntry, Schema
+
+from singer import Transformer, metadata
+from singer.utils import now
+
+from tap_deputy import paging
+from tap_deputy.sync import (RecordPipeline, decode_ids, encode_ids, get_backfill_windows,
+                             get_shard_starts, process_records)
+from helpers import MockClient, make_records, make_stream, run_sync
+
+
+class TestSync(unittest.TestCase):
+    def setUp(self):
+        self.data = {'Roster': make_records(1200),
+                     'Timesheet': make_records(30),
+                     'Country': make_records(3)}
+        self.catalog = Catalog([make_stream('rosters', 'Roster'),
+                                make_stream('timesheets', 'Timesheet'),
+                                make_stream('countries', 'Country')])
+
+    def test_concurrent_sync_emits_all_records(self):
+        state = {}
+        messages = run_sync(MockClient(self.data), self.catalog, state, {'max_workers': 3})
+
+        for stream_name, resource_name in [('rosters', 'Roster'),
+                                           ('timesheets', 'Timesheet'),
+                                           ('countries', 'Country')]:
+            records = [m for m in messages
+                       if m['type'] == 'RECORD' and m['stream'] == stream_name]
+            self.assertEqual(len(records), len(self.data[resource_name]))
+            self.assertIn(stream_name, state['bookmarks'])
+
+        self.assertIsNone(state.get('currently_syncing'))
+        self.assertEqual(messages[-1]['type'], 'STATE')
+
+    def test_concurrent_sync_matches_serial_output(self):
+        serial = run_sync(MockClient(self.data), self.catalog, {}, {})
+        concurrent = run_sync(MockClient(self.data), self.catalog, {}, {'max_workers': '2'})
+
+        def records(messages):
+            return sorted((m['stream'], m['record']['Id'])
+                          for m in messages if m['type'] == 'RECORD')
+
+        self.assertEqual(records(serial), records(concurrent))
+
+    def test_failed_stream_stays_currently_syncing(self):
+        state = {}
+        with self.assertRaises(Exception):
+            run_sync(MockClient(self.data, fail_resource='Timesheet'),
+                     self.catalog,
+                     state,
+                     {'max_workers': 2})
+
+        self.assertEqual(state['currently_syncing'], 'timesheets')
+        self.assertNotIn('timesheets', state.get('bookmarks', {}))
+
+    @mock.patch('tap_deputy.sync.Transformer', wraps=Transformer)
+    def test_one_transformer_per_stream(self, mocked_transformer):
+        messages = run_sync(MockClient(self.data), self.catalog, {}, {})
+
+        self.assertEqual(mocked_transformer.call_count, 3)
+        self.assertEqual(len([m for m in messages if m['type'] == 'RECORD']), 1233)
+
+
+    def test_prefetched_pages_are_not_streamed(self):
+        # MockClient has no stream_post, so this fails if pages are streamed
+        messages = run_sync(MockClient(self.data), self.catalog, {},
+                            {'stream_records': True, 'prefetch_pages': 2})
+
+        self.assertEqual(len([m for m in messages if m['type'] == 'RECORD']), 1233)
+
+
+class TestProjection(unittest.TestCase):
+    def test_projection_matches_transformer_filtering(self):
+        fields = ['Id', 'Modified', 'Name', 'Cost', 'Notes', 'Blob']
+        stream = CatalogEntry(
+            stream='timesheets',
+            tap_stream_id='timesheets',
+            key_properties=['Id'],
+            schema=Schema.from_dict({
+                'type': 'object',
+                'properties': {field: {'type': ['null', 'string', 'integer']}
+                               for field in fields}
+            }),
+            metadata=[
+                {'breadcrumb': [],
+                 'metadata': {'tap-deputy.resource': 'Timesheet', 'selected': True}},
+                {'breadcrumb': ['properties', 'Id'], 'metadata': {'inclusion': 'automatic',
+                                                                  'selected': False}},
+                {'breadcrumb': ['properties', 'Modified'], 'metadata': {'selected': False}},
+                {'breadcrumb': ['properties', 'Name'], 'metadata': {'selected': True}},
+                {'breadcrumb': ['properties', 'Cost'], 'metadata': {'selected': False}},
+                {'breadcrumb': ['properties', 'Blob'], 'metadata': {'inclusion': 'unsupported'}}
+            ])
+        rows = [dict({field: 'x' for field in fields}, Id=i, Modified='2021-01-02T00:00:00Z',
+                     Unknown='y')
+                for i in range(3)]
+
+        messages = run_sync(MockClient({'Timesheet': rows}), Catalog([stream]), {}, {})
+
+        records = [m['record'] for m in messages if m['type'] == 'RECORD']
+        schema = stream.schema.to_dict()
+        mdata = metadata.to_map(stream.metadata)
+        with Transformer() as transformer:
+            expected = [transformer.transform(dict(row), schema, mdata) for row in rows]
+        self.assertEqual(records, expected)
+        self.assertEqual(sorted(records[0].keys()), ['Id', 'Name', 'Notes'])
+
+
+class TestProcessRecords(unittest.TestCase):
+    @mock.patch('tap_deputy.sync.output.write_record')
+    def test_streamed_records_are_written_as_they_arrive(self, mocked_write):
+        stream = make_stream('rosters', 'Roster')
+        records = make_records(40)
+
+        def decode():
+            for index, record in enumerate(records):
+                # every earlier record is already written
+                self.assertEqual(mocked_write.call_count, index)
+                yield record
+
+        with RecordPipeline(stream, metadata.to_map(stream.metadata)) as pipeline:
+            max_modified = process_records(pipeline, '2021-01-01T00:00:00+00:00',
+                                           paging.StreamedPage(decode()))
+
+        self.assertEqual(mocked_write.call_count, 40)
+        self.assertEqual(max_modified, '2021-01-01T00:00:39+00:00')
+        self.assertGreater(pipeline.stats.seconds['transform'], 0)
+
+
+class TestStateEmission(unittest.TestCase):
+    def setUp(self):
+        self.data = {'Roster': make_records(5000)}
+        self.catalog = Catalog([make_stream('rosters', 'Roster')])
+
+    def test_bookmarks_written_every_page_by_default(self):
+        messages = run_sync(MockClient(self.data), self.catalog, {}, {})
+
+        # one per page plus currently_syncing set and cleared
+        self.assertEqual(len([m for m in messages if m['type'] == 'STATE']), 13)
+
+    def test_bookmarks_coalesced_by_record_count(self):
+        state = {}
+        messages = run_sync(MockClient(self.data), self.catalog, state,
+                            {'state_flush_records': 2000})
+
+        states = [m for m in messages if m['type'] == 'STATE']
+        self.assertEqual(len(states), 4)
+        self.assertEqual(states[-1]['value'], state)
+        self.assertEqual(state['bookmarks']['rosters'], '2021-01-01T00:00:59+00:00')
+
+    def test_coalesced_bookmark_flushed_on_failure(self):
+        state = {}
+        with self.assertRaises(Exception):
+            run_sync(MockClient(self.data, fail_resource='Roster', fail_after=3),
+                     self.catalog,
+                     state,
+                     {'state_flush_seconds': 3600})
+
+        self.assertIn('rosters', state['bookmarks'])
+        self.assertEqual(state['currently_syncing'], 'rosters')
+
+
+class TestBackfill(unittest.TestCase):
+    def setUp(self):
+        self.data = {'Timesheet': [{'Id': i, 'Modified': '{}-06-01T00:00:00+00:00'.format(year)}
+                                   for i, year in enumerate(range(2021, 2026))]}
+        self.catalog = Catalog([make_stream('timesheets', 'Timesheet')])
+        self.config = {'backfill_window_days': 365, 'backfill_max_workers': 3}
+
+    def test_backfill_emits_every_window(self):
+        state = {}
+        messages = run_sync(MockClient(self.data), self.catalog, state, self.config)
+
+        ids = sorted(m['record']['Id'] for m in messages if m['type'] == 'RECORD')
+        self.assertEqual(ids, [0, 1, 2, 3, 4])
+        self.assertEqual(state['backfills'], {})
+        self.assertIn('timesheets', state['bookmarks'])
+
+    def test_backfill_resumes_pending_windows(self):
+        state = {
+            'backfills': {
+                'timesheets': {
+                    'end': '2026-01-01T00:00:00Z',
+                    'pending': [['2023-01-01T00:00:00Z', '2024-01-01T00:00:00Z']]
+                }
+            }
+        }
+        messages = run_sync(MockClient(self.data), self.catalog, state, self.config)
+
+        ids = [m['record']['Id'] for m in messages if m['type'] == 'RECORD']
+        self.assertEqual(ids, [2])
+        self.assertEqual(state['bookmarks']['timesheets'], '2026-01-01T00:00:00Z')
+
+    def test_next_run_compares_the_backfill_bookmark_as_a_point_in_time(self):
+        state = {'backfills': {'timesheets': {'end': '2026-01-01T00:00:00Z', 'pending': []}}}
+        run_sync(MockClient(self.data), self.catalog, state, self.config)
+        self.assertEqual(state['bookmarks']['timesheets'], '2026-01-01T00:00:00Z')
+
+        # an hour after the bookmark, though it sorts before it as a string
+        self.data['Timesheet'].append({'Id': 9, 'Modified': '2025-12-31T20:00:00-05:00'})
+        messages = run_sync(MockClient(self.data), self.catalog, state, self.config)
+
+        ids = [m['record']['Id'] for m in messages if m['type'] == 'RECORD']
+        self.assertEqual(ids, [9])
+        self.assertEqual(state['bookmarks']['timesheets'], '2025-12-31T20:00:00-05:00')
+
+    def test_bookmarked_stream_skips_backfill(self):
+        state = {'bookmarks': {'timesheets': '2024-01-01T00:00:00Z'}}
+        messages = run_sync(MockClient(self.data), self.catalog, state, self.config)
+
+        ids = [m['record']['Id'] for m in messages if m['type'] == 'RECORD']
+        self.assertEqual(ids, [3, 4])
+        self.assertNotIn('backfills', state)
+
+    def test_finished_windows_are_written_despite_coalescing(self):
+        states = []
+        state = {}
+        with mock.patch('tap_deputy.output.singer.write_state',
+                        side_effect=lambda value: states.append(copy.deepcopy(value))), \
+             self.assertRaises(Exception):
+            run_sync(MockClient(self.data, fail_resource='Timesheet', fail_after=2),
+                     self.catalog,
+                     state,
+                     dict(self.config, backfill_max_workers=1, state_flush_records=100000))
+
+        windows = len(get_backfill_windows('2021-01-01T00:00:00Z', now(), 365))
+        pending = [len(value['backfills']['timesheets']['pending'])
+                   for value in states if 'timesheets' in value.get('backfills', {})]
+        self.assertEqual(pending, [windows, windows - 1, windows - 2])
+
+    def test_interrupted_backfill_keeps_pending_windows(self):
+        state = {}
+        with self.assertRaises(Exception):
+            run_sync(MockClient(self.data, fail_resource='Timesheet'),
+                     self.catalog,
+                     state,
+                     self.config)
+
+        self.assertTrue(state['backfills']['timesheets']['pending'])
+        self.assertNotIn('timesheets', state.get('bookmarks', {}))
+
+
+class TestShards(unittest.TestCase):
+    def setUp(self):
+        # site 3 was created after the shards were listed
+        self.data = {
+            'Timesheet': [{'Id': i,
+                           'OperationalUnit': i % 3 + 1,
+                           'Modified': '2021-01-01T00:00:{:02d}Z'.format(i % 60)}
+                          for i in range(1100)],
+            'OperationalUnit': [{'Id': 1}, {'Id': 2}]
+        }
+        self.catalog = Catalog([make_stream('timesheets', 'Timesheet')])
+        self.config = {'stream_shards': {'timesheets': 'OperationalUnit'},
+                       'shard_max_workers': 3}
+
+    def test_shards_emit_every_record_once(self):
+        state = {}
+        messages = run_sync(MockClient(self.data), self.catalog, state, self.config)
+
+        ids = sorted(m['record']['Id'] for m in messages if m['type'] == 'RECORD')
+        self.assertEqual(ids, list(range(1100)))
+        self.assertEqual(set(state['shard_bookmarks']['timesheets']),
+                         {'1', '2', 'other', 'null'})
+        # site 1 has nothing modified after 57 seconds
+        self.assertEqual(state['bookmarks']['timesheets'], '2021-01-01T00:00:57Z')
+
+    def test_rows_without_a_partition_value_are_synced(self):
+        self.data['Timesheet'].append({'Id': 2000,
+                                       'OperationalUnit': None,
+                                       'Modified': '2021-01-01T00:00:30Z'})
+        state = {}
+        messages = run_sync(MockClient(self.data), self.catalog, state, self.config)
+
+        ids = sorted(m['record']['Id'] for m in messages if m['type'] == 'RECORD')
+        self.assertEqual(ids, list(range(1100)) + [2000])
+        self.assertEqual(state['shard_bookmarks']['timesheets']['null'],
+                         '2021-01-01T00:00:30Z')
+
+    def test_empty_shard_does_not_hold_back_the_stream_bookmark(self):
+        # site 4 has no rows at all
+        self.data['OperationalUnit'].append({'Id': 4})
+        state = {}
+        run_sync(MockClient(self.data), self.catalog, state, self.config)
+
+        self.assertEqual(state['shard_bookmarks']['timesheets']['4'], '2021-01-01T00:00:59Z')
+        self.assertEqual(state['bookmarks']['timesheets'], '2021-01-01T00:00:57Z')
+
+    def test_stream_bookmark_is_the_earliest_shard(self):
+        state = {'bookmarks': {'timesheets': '2021-01-01T00:00:00Z'},
+                 'shard_bookmarks': {'timesheets': {'1': '2021-01-01T00:00:50Z',
+                                                    '2': '2021-01-01T00:00:50Z',
+                                                    'other': '2021-01-01T00:00:50Z'}}}
+        self.data['Timesheet'] = [row for row in self.data['Timesheet']
+                                  if row['OperationalUnit'] != 1 or
+                                  row['Modified'] < '2021-01-01T00:00:55Z']
+
+        messages = run_sync(MockClient(self.data), self.catalog, state, self.config)
+
+        self.assertTrue(all(m['record']['Modified'] >= '2021-01-01T00:00:50'
+                            for m in messages if m['type'] == 'RECORD'))
+        self.assertEqual(state['shard_bookmarks']['timesheets']['1'],
+                         '2021-01-01T00:00:54Z')
+        self.assertEqual(state['bookmarks']['timesheets'], '2021-01-01T00:00:54Z')
+
+    def test_removed_shards_resume_in_the_remainder(self):
+        state = {'bookmarks': {'timesheets': '2021-01-01T00:00:00Z'},
+                 'shard_bookmarks': {'timesheets': {'1': '2021-01-01T10:00:00+10:00',
+                                                    '9': '2021-01-01T00:00:10Z',
+                                                    'other': '2021-01-01T00:00:30Z'}}}
+
+        starts = get_shard_starts(state, 'timesheets', {'1': {}, '2': {}, 'other': {}},
+                                  '2020-01-01T00:00:00Z')
+
+        self.assertEqual(starts, {'1': '2021-01-01T10:00:00+10:00',
+                                  '2': '2021-01-01T00:00:00Z',
+                                  'other': '2021-01-01T00:00:10Z'})
+
+
+class TestBookmarkIds(unittest.TestCase):
+    def setUp(self):
+        # a bulk edit stamped most rows with the same second
+        self.data = {'Timesheet': make_records(100) +
+                                  [{'Id': i, 'Modified': '2021-01-02T00:00:00Z'}
+                                   for i in range(100, 1100)]}
+        self.catalog = Catalog([make_stream('timesheets', 'Timesheet')])
+        self.config = {'bookmark_ids_limit': 10000}
+
+    def get_record_ids(self, messages):
+        return [m['record']['Id'] for m in messages if m['type'] == 'RECORD']
+
+    def test_next_run_skips_rows_emitted_at_the_bookmark(self):
+        state = {}
+        first = run_sync(MockClient(self.data), self.catalog, state, self.config)
+        self.assertEqual(len(self.get_record_ids(first)), 1100)
+        self.assertEqual(state['bookmark_ids']['timesheets'],
+                         {'modified': '2021-01-02T00:00:00Z', 'ids': [[100, 1099]]})
+
+        self.data['Timesheet'].append({'Id': 5000, 'Modified': '2021-01-02T00:00:00Z'})
+        second = run_sync(MockClient(self.data), self.catalog, state, self.config)
+
+        self.assertEqual(self.get_record_ids(second), [5000])
+        self.assertEqual(state['bookmark_ids']['timesheets']['ids'],
+                         [[100, 1099], [5000, 5000]])
+
+    def test_ids_beyond_the_limit_are_emitted_again(self):
+        state = {}
+        run_sync(MockClient(self.data), self.catalog, state, {'bookmark_ids_limit': 10})
+        second = run_sync(MockClient(self.data), self.catalog, state,
+                          {'bookmark_ids_limit': 10})
+
+        self.assertEqual(sorted(self.get_record_ids(second)), list(range(110, 1100)))
+
+    def test_ids_of_another_bookmark_are_ignored(self):
+        state = {'bookmarks': {'timesheets': '2021-01-02T00:00:00Z'},
+                 'bookmark_ids': {'timesheets': {'modified': '2021-01-01T00:00:00Z',
+                                                 'ids': [[100, 1099]]}}}
+        messages = run_sync(MockClient(self.data), self.catalog, state, self.config)
+
+        self.assertEqual(len(self.get_record_ids(messages)), 1000)
+
+    def test_rows_at_the_bookmark_are_emitted_again_by_default(self):
+        state = {}
+        run_sync(MockClient(self.data), self.catalog, state, {})
+        second = run_sync(MockClient(self.data), self.catalog, state, {})
+
+        self.assertNotIn('bookmark_ids', state)
+        self.assertEqual(len(self.get_record_ids(second)), 1000)
+
+    def test_ids_encode_as_ranges(self):
+        ids = {1, 2, 3, 7, 9, 10}
+        self.assertEqual(encode_ids(ids), [[1, 3], [7, 7], [9, 10]])
+        self.assertEqual(decode_ids(encode_ids(ids)), ids)